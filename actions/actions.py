@@ -1,41 +1,97 @@
-from pydantic import ValidationError
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from pydantic import ValidationError, TypeAdapter
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from actions.user_actions.user_actions import UserActions
 from exceptions.exceptions import PermissionDenied, SerializerValidationError
+from permissions.permission_service import PermissionService
+
+# TypeAdapter builds its validator once, so adapters are shared by all actions
+_list_adapters = {}
 
 
 class Actions:
     pagination_class = None
     serializer_class = None
 
+    def __init__(self, permission_service: PermissionService = None,
+                 read_session_pool: async_sessionmaker = None) -> None:
+        """
+        :param read_session_pool: async_sessionmaker - sessions of the read-only replica
+        """
+        self.permission_service = permission_service
+        self.read_session_pool = read_session_pool
+
+    @asynccontextmanager
+    async def read_session(self, session: AsyncSession) -> AsyncIterator[AsyncSession]:
+        """
+        Session for read-only queries: a replica session when the actions have the replica,
+        otherwise the given session of the update. Replica can lag behind the primary,
+        so only reads that may be a bit stale go through it, never reads cached under the catalog version
+        """
+        if self.read_session_pool is None:
+            yield session
+            return
+        async with self.read_session_pool() as read_session:
+            yield read_session
+
     @staticmethod
     def check_permission(permission_class):
+        """
+        permission_class.permission gets the cached UserRoles of the user
+        when the actions have a permission service, otherwise the whole User
+        """
         def bar(func):
-            async def wrapper(*args, **kwargs):
+            async def wrapper(self, *args, **kwargs):
+                if permission_class is None:
+                    return await func(self, *args, **kwargs)
+
                 username = kwargs.get('username')
-                if permission_class is not None:
-                    user = await UserActions.get_user_by_username(username=username, session=kwargs.get('session'))
-                    if permission_class.permission(user):
-                        return await func(*args, **kwargs)
-                    else:
-                        raise PermissionDenied()
+                session = kwargs.get('session')
+                if self.permission_service is not None:
+                    user = await self.permission_service.get_roles(username=username, session=session)
+                else:
+                    user = await UserActions.get_user_by_username(username=username, session=session)
+
+                if user is not None and permission_class.permission(user):
+                    return await func(self, *args, **kwargs)
+                else:
+                    raise PermissionDenied()
 
             return wrapper
 
         return bar
 
+    @classmethod
+    def serializer_fields(cls) -> list[str]:
+        return list(cls.serializer_class.model_fields)
+
+    @classmethod
+    def _get_list_adapter(cls) -> TypeAdapter:
+        adapter = _list_adapters.get(cls.serializer_class)
+        if adapter is None:
+            adapter = _list_adapters[cls.serializer_class] = TypeAdapter(list[cls.serializer_class])
+        return adapter
+
     @classmethod
     async def serialize(cls, objects):
+        """
+        Validates all the objects by one call of the list adapter of serializer_class
+        :param objects: row mappings (see serializer_fields) or ORM objects
+        :return: list[dict]
+        """
         if cls.serializer_class is None:
             raise Exception('You did not specify serializer class')
-        new_objects_list = []
-        for object in objects:
-            try:
-                new_objects_list.append(cls.serializer_class(**object.__dict__).dict())
-            except ValidationError as error:
-                field = str(error).split('Field')[0]
-                raise SerializerValidationError(field)
-        return new_objects_list
+        rows = [dict(object) if isinstance(object, Mapping) else object.__dict__ for object in objects]
+        adapter = cls._get_list_adapter()
+        try:
+            return adapter.dump_python(adapter.validate_python(rows))
+        except ValidationError as error:
+            field = str(error.errors()[0]['loc'][-1])
+            raise SerializerValidationError(field)
 
     @classmethod
     def paginate(cls, objects) -> list:
@@ -43,8 +99,19 @@ class Actions:
             yield objects[i:i + cls.pagination_class.max_items]
 
     @classmethod
-    async def paginated_objects(cls, objects) -> list[list]:
+    async def paginated_objects(cls, objects, **cursor) -> list[list]:
+        """
+        :param objects: list of serialized objects that will be split into pages,
+        or DAL keyset page loader (like ProductDAL.get_products_page),
+        then only one page of pagination_class.max_items objects is fetched and serialized,
+        only the columns of serializer_class are selected
+        :param cursor: after_id/before_id for the page loader
+        :return: list[list]
+        """
         if cls.pagination_class is not None:
+            if callable(objects):
+                page = await objects(limit=cls.pagination_class.max_items, columns=cls.serializer_fields(), **cursor)
+                return [await cls.serialize(page)]
             paginated_products = list(cls.paginate(objects))
             return paginated_products
         return objects
@@ -1,11 +1,15 @@
+import math
+from functools import partial
 from typing import Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from actions.actions import Actions
+from actions.basket_actions.basket_buffer import BasketBuffer, ADD, REMOVE
 from actions.basket_actions.pagination import BasketPagination
 from database.dals import BasketDAL
-from database.models import Basket, Product, User
+from database.models import Basket
+from permissions.permission_service import PermissionService
 from serializers.basket_serializer import BasketProductsSerializer
 
 
@@ -18,27 +22,75 @@ class BasketActions(Actions):
         new_basket = await BasketDAL.create_basket()
         return new_basket
 
-    @staticmethod
-    async def add_product_to_user_basket(user: User, product: Product, session: AsyncSession) -> User:
-        async with session.begin():
-            basket_dal = BasketDAL(session=session)
-            new_basket_with_products = await basket_dal.add_product_to_basket(user=user, product=product)
-            user.basket = new_basket_with_products
-            return user
+    def __init__(self, permission_service: PermissionService = None, basket_buffer: BasketBuffer = None) -> None:
+        """
+        :param basket_buffer: BasketBuffer - adds and removes are written behind through Redis when it is given
+        """
+        # baskets are never read from the replica, a user expects to see the product just added
+        super().__init__(permission_service=permission_service)
+        self.basket_buffer = basket_buffer
 
-    @staticmethod
-    async def remove_product_from_basket(user: User, product: Product, session: AsyncSession) -> User:
-        async with session.begin():
+    async def _get_buffered_changes(self, username: str) -> tuple[list[int], list[int]]:
+        if self.basket_buffer is None:
+            return [], []
+        changes = await self.basket_buffer.get_changes(username)
+        added_ids = [product_id for product_id, operation in changes.items() if operation == ADD]
+        removed_ids = [product_id for product_id, operation in changes.items() if operation == REMOVE]
+        return added_ids, removed_ids
+
+    async def has_product(self, username: str, product_id: int, session: AsyncSession) -> bool:
+        if self.basket_buffer is not None:
+            operation = await self.basket_buffer.get_operation(username=username, product_id=product_id)
+            if operation is not None:
+                return operation == ADD
+
+        basket_dal = BasketDAL(session=session)
+        return await basket_dal.has_product(username=username, product_id=product_id)
+
+    async def add_product_to_user_basket(self, username: str, product_id: int, session: AsyncSession) -> bool:
+        if self.basket_buffer is None:
             basket_dal = BasketDAL(session=session)
-            new_basket_without_product = await basket_dal.remove_product_from_basket(user=user, product=product)
-            user.basket = new_basket_without_product
-            return user
+            return await basket_dal.add_product_to_basket(username=username, product_id=product_id)
+
+        if await self.has_product(username=username, product_id=product_id, session=session):
+            return False
+        await self.basket_buffer.add(username=username, product_id=product_id)
+        return True
 
-    async def get_user_basket(self, user_id: int, session: AsyncSession) -> Optional[list[list[dict]]]:
-        async with session.begin():
+    async def remove_product_from_basket(self, username: str, product_id: int, session: AsyncSession) -> bool:
+        if self.basket_buffer is None:
             basket_dal = BasketDAL(session=session)
-            user_basket_products = await basket_dal.get_user_basket(user_id=user_id)
-            if user_basket_products is None:
-                return None
+            return await basket_dal.remove_product_from_basket(username=username, product_id=product_id)
+
+        if not await self.has_product(username=username, product_id=product_id, session=session):
+            return False
+        await self.basket_buffer.remove(username=username, product_id=product_id)
+        return True
+
+    async def get_user_basket(self, username: str, session: AsyncSession, after_id: Optional[int] = None,
+                              before_id: Optional[int] = None) -> list[dict]:
+        """
+        This method returns one page of the user's basket, the page is taken by keyset on product_id,
+        changes that are not flushed from the basket buffer yet are taken into account
+        :param username: str
+        :param session: AsyncSession
+        :param after_id: int - id of the last product of the current page, for the next page
+        :param before_id: int - id of the first product of the current page, for the previous page
+        :return: list[dict] - serialized products of the page
+        """
+        added_ids, removed_ids = await self._get_buffered_changes(username)
+        basket_dal = BasketDAL(session=session)
+        pages = await self.paginated_objects(
+            partial(basket_dal.get_basket_page, username=username, added_ids=added_ids, removed_ids=removed_ids),
+            after_id=after_id,
+            before_id=before_id
+        )
+        return pages[0]
 
-            return await self.paginated_objects(await self.serialize(user_basket_products))
+    async def count_pages(self, username: str, session: AsyncSession) -> int:
+        added_ids, removed_ids = await self._get_buffered_changes(username)
+        basket_dal = BasketDAL(session=session)
+        products_count = await basket_dal.count_basket_products(
+            username=username, added_ids=added_ids, removed_ids=removed_ids
+        )
+        return max(math.ceil(products_count / self.pagination_class.max_items), 1)
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aioredis import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from database.dals import BasketDAL
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+class BasketBuffer:
+    """
+    Write-behind store of basket changes. Adds and removes go only to a Redis hash
+    per basket {product_id: add/remove}, BasketFlusher moves them to Postgres in batches.
+    While a basket is flushed its changes are kept in a separate hash, so they are
+    still visible for reads and are not lost if the process dies in the middle of a flush
+    """
+    PENDING_KEY = 'basket:{username}:pending'
+    FLUSHING_KEY = 'basket:{username}:flushing'
+    DIRTY_KEY = 'basket:dirty'
+
+    # takes pending changes for a flush, unless the previous flush of the basket is not finished
+    TAKE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('RENAME', KEYS[1], KEYS[2])
+    end
+    return redis.call('HGETALL', KEYS[2])
+    """
+    # the basket stays dirty if it got new changes during the flush
+    ACK_SCRIPT = """
+    redis.call('DEL', KEYS[2])
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('SREM', KEYS[3], ARGV[1])
+    end
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self._take = redis.register_script(self.TAKE_SCRIPT)
+        self._ack = redis.register_script(self.ACK_SCRIPT)
+
+    def _keys(self, username: str) -> list[str]:
+        return [
+            self.PENDING_KEY.format(username=username),
+            self.FLUSHING_KEY.format(username=username),
+            self.DIRTY_KEY
+        ]
+
+    async def _set(self, username: str, product_id: int, operation: str) -> None:
+        pending_key, _, dirty_key = self._keys(username)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(pending_key, product_id, operation)
+            pipe.sadd(dirty_key, username)
+            await pipe.execute()
+
+    async def add(self, username: str, product_id: int) -> None:
+        await self._set(username, product_id, ADD)
+
+    async def remove(self, username: str, product_id: int) -> None:
+        await self._set(username, product_id, REMOVE)
+
+    async def get_operation(self, username: str, product_id: int) -> Optional[str]:
+        """
+        :return: the last not flushed operation with the product, None if there is no such
+        """
+        pending_key, flushing_key, _ = self._keys(username)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hget(pending_key, product_id)
+            pipe.hget(flushing_key, product_id)
+            pending, flushing = await pipe.execute()
+        return pending or flushing
+
+    async def get_changes(self, username: str) -> dict[int, str]:
+        pending_key, flushing_key, _ = self._keys(username)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(flushing_key)
+            pipe.hgetall(pending_key)
+            flushing, pending = await pipe.execute()
+        return {int(product_id): operation for product_id, operation in {**flushing, **pending}.items()}
+
+    async def get_dirty(self, count: int) -> list[str]:
+        return await self.redis.srandmember(self.DIRTY_KEY, count)
+
+    async def take(self, username: str) -> dict[int, str]:
+        changes = await self._take(keys=self._keys(username))
+        return {int(changes[i]): changes[i + 1] for i in range(0, len(changes), 2)}
+
+    async def ack(self, username: str) -> None:
+        await self._ack(keys=self._keys(username), args=[username])
+
+
+class BasketFlusher:
+    """
+    Periodically writes the changes of BasketBuffer into association_table
+    """
+
+    def __init__(self, basket_buffer: BasketBuffer, session_pool: async_sessionmaker,
+                 interval: float = config.BASKET_FLUSH_INTERVAL, batch_size: int = config.BASKET_FLUSH_BATCH) -> None:
+        self.basket_buffer = basket_buffer
+        self.session_pool = session_pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+
+    async def flush_batch(self) -> int:
+        """
+        :return: int - count of flushed baskets
+        """
+        usernames = await self.basket_buffer.get_dirty(self.batch_size)
+        if not usernames:
+            return 0
+
+        changes = {username: await self.basket_buffer.take(username) for username in usernames}
+        async with self.session_pool() as session:
+            async with session.begin():
+                basket_dal = BasketDAL(session=session)
+                basket_ids = await basket_dal.get_basket_ids(usernames=usernames)
+                added, removed = [], []
+                for username, basket_changes in changes.items():
+                    basket_id = basket_ids.get(username)
+                    if basket_id is None:
+                        continue
+                    for product_id, operation in basket_changes.items():
+                        if operation == ADD:
+                            added.append((basket_id, product_id))
+                        else:
+                            removed.append((basket_id, product_id))
+                await basket_dal.bulk_remove_products(removed)
+                await basket_dal.bulk_add_products(added)
+
+        for username in usernames:
+            await self.basket_buffer.ack(username)
+        logging.info(f'FLUSHED {len(usernames)} BASKETS: +{len(added)} -{len(removed)}')
+        return len(usernames)
+
+    async def flush_all(self) -> None:
+        """
+        Also recovers changes left by a process that died during a flush
+        """
+        while await self.flush_batch() > 0:
+            pass
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_all()
+            except Exception as error:
+                logging.exception(f'BASKET FLUSH FAILED: {error}')
+
+    async def start(self) -> None:
+        await self.flush_all()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            # a flush cut by the cancel leaves its batch in the flushing hash, which the last flush recovers
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
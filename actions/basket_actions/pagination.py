@@ -1,2 +1,5 @@
+import config
+
+
 class BasketPagination:
-    max_items = 2
+    max_items = config.BASKET_PAGE_SIZE
@@ -0,0 +1,68 @@
+import hashlib
+import json
+from typing import Optional
+
+from aioredis import Redis
+
+import config
+
+
+class CatalogCache:
+    """
+    Shared snapshot of the catalog pages. Pages are stored under the catalog version,
+    the version is bumped on every catalog change, so the old snapshot just expires.
+    Pages of different sizes are stored apart, so processes with other PRODUCT_PAGE_SIZE do not mix them
+    """
+    VERSION_KEY = 'catalog:version'
+    PAGE_KEY = 'catalog:{version}:{page_size}:page:{page}'
+    PAGES_KEY = 'catalog:{version}:{page_size}:pages'
+    SEARCH_KEY = 'catalog:{version}:search:{query_hash}'
+
+    def __init__(self, redis: Redis, ttl: int = config.CATALOG_CACHE_TTL,
+                 page_size: int = config.PRODUCT_PAGE_SIZE, search_ttl: int = config.SEARCH_CACHE_TTL) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.page_size = page_size
+        self.search_ttl = search_ttl
+
+    async def get_version(self) -> int:
+        version = await self.redis.get(self.VERSION_KEY)
+        return int(version) if version is not None else 0
+
+    async def bump_version(self) -> int:
+        return await self.redis.incr(self.VERSION_KEY)
+
+    async def get_page(self, version: int, page: int) -> Optional[list[dict]]:
+        products = await self.redis.get(self.PAGE_KEY.format(version=version, page_size=self.page_size, page=page))
+        if products is not None:
+            return json.loads(products)
+
+    async def set_page(self, version: int, page: int, products: list[dict]) -> None:
+        await self.redis.set(
+            self.PAGE_KEY.format(version=version, page_size=self.page_size, page=page),
+            json.dumps(products, default=str),
+            ex=self.ttl
+        )
+
+    async def get_pages(self, version: int) -> Optional[int]:
+        pages = await self.redis.get(self.PAGES_KEY.format(version=version, page_size=self.page_size))
+        if pages is not None:
+            return int(pages)
+
+    async def set_pages(self, version: int, pages: int) -> None:
+        await self.redis.set(self.PAGES_KEY.format(version=version, page_size=self.page_size), pages, ex=self.ttl)
+
+    def _search_key(self, version: int, query: str) -> str:
+        return self.SEARCH_KEY.format(version=version, query_hash=hashlib.sha1(query.encode()).hexdigest())
+
+    async def get_search(self, version: int, query: str) -> Optional[list[dict]]:
+        products = await self.redis.get(self._search_key(version=version, query=query))
+        if products is not None:
+            return json.loads(products)
+
+    async def set_search(self, version: int, query: str, products: list[dict]) -> None:
+        await self.redis.set(
+            self._search_key(version=version, query=query),
+            json.dumps(products, default=str),
+            ex=self.search_ttl
+        )
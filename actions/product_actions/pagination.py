@@ -1,2 +1,5 @@
+import config
+
+
 class ProductPagination:
-    max_items = 2
+    max_items = config.PRODUCT_PAGE_SIZE
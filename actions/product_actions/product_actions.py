@@ -1,22 +1,133 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+import datetime
+import itertools
+import math
+from functools import partial
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional
 
+from pydantic import TypeAdapter, ValidationError
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+import config
 from actions.actions import Actions
+from actions.product_actions.catalog_cache import CatalogCache
 from actions.product_actions.pagination import ProductPagination
 from database.dals import ProductDAL
+from database.unit_of_work import UnitOfWork
 from database.models import Product
+from permissions.permission_service import PermissionService
 from permissions.product_permissions import PermissionAdmin
-from serializers.products_serializer import ProductSerializer
+from serializers.products_serializer import ProductSerializer, ProductImportSerializer
+from services.product_files import DEFAULT_IMAGE_PATH, PRODUCT_COLUMNS, ImageResolver, ProductFileWriter
+from services.product_index import ProductIndex
+
+_import_adapter = TypeAdapter(list[ProductImportSerializer])
+
+
+class ImportReport(NamedTuple):
+    imported: int
+    rejected: int
+    # the first errors, for the admin to fix the file
+    errors: list[str]
 
 
 class ProductActions(Actions):
     pagination_class = ProductPagination
     serializer_class = ProductSerializer
 
-    async def show_products(self, session: AsyncSession) -> list[list[dict]]:
-        async with session.begin():
+    def __init__(self, catalog_cache: CatalogCache, permission_service: PermissionService = None,
+                 read_session_pool: async_sessionmaker = None, product_index: ProductIndex = None) -> None:
+        """
+        :param product_index: ProductIndex - created products are added into it on commit
+        """
+        super().__init__(permission_service=permission_service, read_session_pool=read_session_pool)
+        self.catalog_cache = catalog_cache
+        self.product_index = product_index
+
+    async def get_catalog_version(self) -> int:
+        return await self.catalog_cache.get_version()
+
+    async def show_products(self, session: AsyncSession, page: int = 0, version: Optional[int] = None,
+                            after_id: Optional[int] = None, before_id: Optional[int] = None,
+                            cursor_version: Optional[int] = None) -> list[dict]:
+        """
+        This method returns one page of products from the shared catalog cache,
+        a missing page is taken from the database by one keyset query from the product next to it
+        :param session: AsyncSession
+        :param page: int - page index
+        :param version: int - catalog version, the current one by default
+        :param after_id: int - last product of the page before, from the button
+        :param before_id: int - first product of the page after, from the button
+        :param cursor_version: int - catalog version the button was made from
+        :return: list[dict] - serialized products of the page
+        """
+        if version is None:
+            version = await self.get_catalog_version()
+
+        products = await self.catalog_cache.get_page(version=version, page=page)
+        if products is not None:
+            return products
+
+        if page == 0:
+            after_id, before_id, cursor_version = None, None, version
+        elif after_id is None and before_id is None:
+            # without a button the page is reachable only from the cached page before it
+            previous_products = await self.catalog_cache.get_page(version=version, page=page - 1)
+            if not previous_products:
+                return []
+            after_id, cursor_version = previous_products[-1]['product_id'], version
+
+        # pages are cached under the version, so they are read from the primary, that has the version applied
+        product_dal = ProductDAL(session=session)
+        pages = await self.paginated_objects(product_dal.get_products_page, after_id=after_id, before_id=before_id)
+        products = pages[0]
+        # a page found from a button of an older version can be shifted against the pages of this version
+        if cursor_version == version:
+            await self.catalog_cache.set_page(version=version, page=page, products=products)
+        return products
+
+    async def count_pages(self, session: AsyncSession, version: Optional[int] = None, estimate: bool = True) -> int:
+        if version is None:
+            version = await self.get_catalog_version()
+
+        pages = await self.catalog_cache.get_pages(version=version)
+        if pages is not None:
+            return pages
+
+        product_dal = ProductDAL(session=session)
+        products_count = await product_dal.count_products(estimate=estimate)
+        pages = max(math.ceil(products_count / self.pagination_class.max_items), 1)
+        await self.catalog_cache.set_pages(version=version, pages=pages)
+        return pages
+
+    async def search_products(self, query: str, session: AsyncSession, page: int = 0,
+                              version: Optional[int] = None) -> tuple[list[dict], int]:
+        """
+        This method returns one page of the products found by the query, the ranked results
+        of a query are cached for config.SEARCH_CACHE_TTL, so flipping pages does not repeat the search
+        :param query: str - search text of the user
+        :param session: AsyncSession
+        :param page: int - page index
+        :param version: int - catalog version, the current one by default
+        :return: (serialized products of the page, count of pages)
+        """
+        query = ' '.join(query.lower().split())[:config.SEARCH_QUERY_MAX_LENGTH]
+        if version is None:
+            version = await self.get_catalog_version()
+
+        products = await self.catalog_cache.get_search(version=version, query=query)
+        if products is None:
             product_dal = ProductDAL(session=session)
-            products = await product_dal.get_all_products()
-            return await self.paginated_objects(await self.serialize(products))
+            found_products = await product_dal.search_products(
+                search_query=query, limit=config.SEARCH_RESULTS_LIMIT, columns=self.serializer_fields()
+            )
+            products = await self.serialize(found_products)
+            await self.catalog_cache.set_search(version=version, query=query, products=products)
+
+        pages = list(self.paginate(products))
+        if page >= len(pages):
+            return [], max(len(pages), 1)
+        return pages[page], len(pages)
 
     @Actions.check_permission(permission_class=PermissionAdmin)
     async def create_product(self, message: dict, session: AsyncSession, username: str) -> Product:
@@ -27,13 +138,115 @@ class ProductActions(Actions):
         :param username: str - needs for checking user's permissions
         :return: Product
         """
-        async with session.begin():
-            product_dal = ProductDAL(session=session)
-            new_product = await product_dal.create_product(message=message)
-            return new_product
+        product_dal = ProductDAL(session=session)
+        new_product = await product_dal.create_product(message=message)
+        UnitOfWork.after_commit(session, self.catalog_cache.bump_version)
+        if self.product_index is not None:
+            product = (await self.serialize([new_product]))[0]
+            UnitOfWork.after_commit(session, partial(self.product_index.add, product))
+        return new_product
+
+    @Actions.check_permission(permission_class=PermissionAdmin)
+    async def get_product_for_broadcast(self, product_id: int, session: AsyncSession,
+                                        username: str) -> Optional[dict]:
+        """
+        Only admins announce products to all the users
+        :param product_id: int
+        :param session: AsyncSession
+        :param username: str - needs for checking user's permissions
+        :return: dict - serialized product, None if there is no such product
+        """
+        product = await self.get_product_by_id(product_id=product_id, session=session)
+        if product is None:
+            return None
+        return (await self.serialize([product]))[0]
+
+    @staticmethod
+    def _validate_import_batch(records: list, first_row: int) -> tuple[list[tuple[int, dict]], list[str]]:
+        """
+        A batch is validated by one call, rows are told apart only when the batch has errors
+        :return: (valid rows with their numbers in the file, errors)
+        """
+        try:
+            rows = _import_adapter.dump_python(_import_adapter.validate_python(records))
+            return list(enumerate(rows, start=first_row)), []
+        except ValidationError as error:
+            invalid = {}
+            for item in error.errors():
+                invalid.setdefault(item['loc'][0], f"{'.'.join(map(str, item['loc'][1:]))}: {item['msg']}")
+            valid_indexes = [index for index in range(len(records)) if index not in invalid]
+            rows = _import_adapter.dump_python(_import_adapter.validate_python([records[i] for i in valid_indexes]))
+            errors = [f'строка {first_row + index}: {message}' for index, message in invalid.items()]
+            return [(first_row + index, row) for index, row in zip(valid_indexes, rows)], errors
+
+    @Actions.check_permission(permission_class=PermissionAdmin)
+    async def import_products(self, records: Iterable, session: AsyncSession, username: str,
+                              image_resolver: ImageResolver,
+                              on_progress: Callable[[int, int], Awaitable] = None) -> ImportReport:
+        """
+        Validates the records by batches of config.IMPORT_BATCH_SIZE and inserts the valid ones by COPY,
+        all the batches are a part of the session transaction, so the catalog gets all of them or none
+        :param records: iterable of parsed rows, read lazily
+        :param session: AsyncSession
+        :param username: str - needs for checking user's permissions
+        :param image_resolver: ImageResolver - stores the images of the rows
+        :param on_progress: coroutine function of (imported, rejected), called after every batch
+        :return: ImportReport
+        """
+        product_dal = ProductDAL(session=session)
+        await product_dal.lock_products_import()
+        records = iter(records)
+        imported, rejected, errors = 0, 0, []
+        created_date = datetime.date.today()
+        first_row = 1
+        while batch := list(itertools.islice(records, config.IMPORT_BATCH_SIZE)):
+            valid_rows, batch_errors = self._validate_import_batch(batch, first_row)
+            first_row += len(batch)
+
+            image_paths = await image_resolver.resolve({row['image'] for _, row in valid_rows if row['image']})
+            copy_rows = []
+            for row_number, row in valid_rows:
+                image_path = image_paths[row['image']] if row['image'] else DEFAULT_IMAGE_PATH
+                if image_path is None:
+                    batch_errors.append(f"строка {row_number}: изображение {row['image']} не найдено")
+                    continue
+                copy_rows.append((row['name'], row['description'], image_path, created_date))
+            await product_dal.copy_products(copy_rows)
+
+            imported += len(copy_rows)
+            rejected += len(batch) - len(copy_rows)
+            errors.extend(batch_errors[:config.IMPORT_REPORTED_ERRORS - len(errors)])
+            if on_progress is not None:
+                await on_progress(imported, rejected)
+
+        if imported:
+            UnitOfWork.after_commit(session, self.catalog_cache.bump_version)
+        return ImportReport(imported=imported, rejected=rejected, errors=errors)
+
+    @Actions.check_permission(permission_class=PermissionAdmin)
+    async def export_products(self, writer: ProductFileWriter, session: AsyncSession, username: str,
+                              on_progress: Callable[[int], Awaitable] = None) -> int:
+        """
+        Streams the whole catalog into the writer by batches of config.EXPORT_BATCH_SIZE
+        :param writer: ProductFileWriter
+        :param session: AsyncSession
+        :param username: str - needs for checking user's permissions
+        :param on_progress: coroutine function of the count of exported products, called after every batch
+        :return: int - count of exported products
+        """
+        exported = 0
+        async with self.read_session(session) as read_session:
+            product_dal = ProductDAL(session=read_session)
+            batches = product_dal.stream_products(columns=PRODUCT_COLUMNS, batch_size=config.EXPORT_BATCH_SIZE)
+            async for batch in batches:
+                writer.write(batch)
+                exported += len(batch)
+                if on_progress is not None:
+                    await on_progress(exported)
+        return exported
 
     async def get_product_by_id(self, product_id: int, session: AsyncSession):
-        async with session.begin():
-            product_dal = ProductDAL(session=session)
+        async with self.read_session(session) as read_session:
+            product_dal = ProductDAL(session=read_session)
             product = await product_dal.get_product_by_id(product_id=product_id)
-            return product
+        return product
@@ -8,14 +8,17 @@ from database.models import User
 class UserActions:
     @staticmethod
     async def create_new_user(message: types.Message, session: AsyncSession) -> User:
-        async with session.begin():
-            user_dal = UserDAL(session=session)
-            new_user = await user_dal.add_user(dict(message))
+        user_dal = UserDAL(session=session)
+        new_user = await user_dal.add_user(dict(message))
         return new_user
 
     @staticmethod
     async def get_user_by_username(username: str, session: AsyncSession) -> User:
-        async with session.begin():
-            user_dal = UserDAL(session=session)
-            user = await user_dal.get_user_by_username(username)
+        user_dal = UserDAL(session=session)
+        user = await user_dal.get_user_by_username(username)
         return user
+
+    @staticmethod
+    async def set_chat_id(username: str, chat_id: int, session: AsyncSession) -> None:
+        user_dal = UserDAL(session=session)
+        await user_dal.set_chat_id(username=username, chat_id=chat_id)
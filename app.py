@@ -1,8 +1,16 @@
 from aiogram import executor, Dispatcher
 
+import config
 from handlers import dp
-from loader import async_sessionmaker
+from database.engine import warm_up
+from loader import (
+    async_sessionmaker, basket_flusher, message_cleaner, media_store, metrics_server, engine, replica_engine,
+    product_index, product_actions, bot_scheduler, broadcaster
+)
 from middlewares.db_middleware import DbMiddleware
+from middlewares.metrics_middleware import MetricsMiddleware
+from middlewares.throttling_middleware import ThrottlingMiddleware
+from webhook import create_web_app
 
 
 async def on_startup(dp: Dispatcher):
@@ -11,12 +19,61 @@ async def on_startup(dp: Dispatcher):
     #     types.BotCommand("start", "Запустить бота"),
     #     types.BotCommand("create_product", "Создать продукт"),
     # ])
+    await warm_up(engine)
+    if replica_engine is not None:
+        await warm_up(replica_engine)
+    # inline queries are answered only from the index, so it is built before the bot starts
+    await product_index.load(version=await product_actions.get_catalog_version())
+    # callbacks dropped by throttling do not open a session
+    dp.middleware.setup(ThrottlingMiddleware())
     dp.middleware.setup(DbMiddleware(session_pool=async_sessionmaker))
+    if metrics_server is not None:
+        dp.middleware.setup(MetricsMiddleware())
+        await metrics_server.start()
+    if bot_scheduler is not None:
+        await bot_scheduler.start()
+    await message_cleaner.start()
+    if basket_flusher is not None:
+        # flushes changes left by the previous run before the bot starts
+        await basket_flusher.start()
+    # broadcasts stopped by the previous run go on from their checkpoints
+    await broadcaster.resume()
 
 
 async def on_shutdown(dp: Dispatcher):
+    await broadcaster.stop()
+    await message_cleaner.stop()
+    media_store.close()
+    if basket_flusher is not None:
+        await basket_flusher.stop()
+    if bot_scheduler is not None:
+        await bot_scheduler.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
     await dp.storage.close()
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+
+async def on_startup_webhook(dp: Dispatcher):
+    await on_startup(dp)
+    await dp.bot.set_webhook(config.WEBHOOK_HOST + config.WEBHOOK_PATH, secret_token=config.WEBHOOK_SECRET)
+
+
+async def on_shutdown_webhook(dp: Dispatcher):
+    await dp.bot.delete_webhook()
+    await on_shutdown(dp)
 
 
 if __name__ == '__main__':
-    executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    if config.BOT_MODE == 'webhook':
+        executor.set_webhook(
+            dp,
+            webhook_path=config.WEBHOOK_PATH,
+            on_startup=on_startup_webhook,
+            on_shutdown=on_shutdown_webhook,
+            web_app=create_web_app()
+        ).run_app(host=config.WEBAPP_HOST, port=config.WEBAPP_PORT)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,167 @@
+"""
+Benchmark of the bulk product import and export against one-by-one creation of products, the way
+the /create_product wizard creates them: one transaction per product. Postgres and Redis are the ones
+from the .env (docker-compose up -d starts them).
+
+    python -m benchmarks.import_export --rows 100000 --baseline-rows 1000 --reset --output import.json
+
+The file is generated as CSV, parsing with validation, the import by COPY and the export are timed
+separately. --reset drops and creates the tables and flushes the cache database, never run it against real data
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+
+# any well formed token, the bot never calls the Bot API here
+os.environ.setdefault('API_TOKEN', '123456:import-benchmark-token')
+
+from sqlalchemy import insert
+
+import config
+from database.models import Base, User
+from database.unit_of_work import UnitOfWork
+from loader import async_sessionmaker, engine, media_store, product_actions, redis_cache
+from services.product_files import ImageResolver, ProductFileWriter, iter_products
+
+ADMIN_USERNAME = 'import_admin'
+
+
+def generate_csv(rows: int) -> bytes:
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(('name', 'description', 'image'))
+    for i in range(rows):
+        writer.writerow((f'product {i}', f'description of the product {i}, "quoted", with a comma', ''))
+    return text.getvalue().encode()
+
+
+async def reset() -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(User), [{'username': ADMIN_USERNAME, 'is_admin': True}])
+    await redis_cache.flushdb()
+
+
+def measure_parsing(data: bytes) -> dict:
+    started = time.perf_counter()
+    valid, rejected = 0, 0
+    records = list(iter_products(io.BytesIO(data), 'csv'))
+    parsed = time.perf_counter()
+    for first_row in range(0, len(records), config.IMPORT_BATCH_SIZE):
+        rows, errors = product_actions._validate_import_batch(
+            records[first_row:first_row + config.IMPORT_BATCH_SIZE], first_row + 1
+        )
+        valid += len(rows)
+        rejected += len(errors)
+    validated = time.perf_counter()
+    return {
+        'rows': len(records),
+        'parse_seconds': round(parsed - started, 3),
+        'validate_seconds': round(validated - parsed, 3),
+        'rows_per_second': round(len(records) / (validated - started)),
+        'valid': valid,
+        'rejected': rejected
+    }
+
+
+async def measure_import(data: bytes) -> dict:
+    started = time.perf_counter()
+    async with async_sessionmaker() as session:
+        report = await product_actions.import_products(
+            records=iter_products(io.BytesIO(data), 'csv'),
+            session=session,
+            username=ADMIN_USERNAME,
+            image_resolver=ImageResolver(media_store=media_store)
+        )
+        await UnitOfWork.commit(session)
+    seconds = time.perf_counter() - started
+    return {
+        'imported': report.imported,
+        'rejected': report.rejected,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(report.imported / seconds)
+    }
+
+
+async def measure_one_by_one(rows: int) -> dict:
+    started = time.perf_counter()
+    for i in range(rows):
+        async with async_sessionmaker() as session:
+            await product_actions.create_product(
+                message={'name': f'single {i}', 'description': f'description {i}', 'image_path': 'media/Box.png'},
+                session=session,
+                username=ADMIN_USERNAME
+            )
+            await UnitOfWork.commit(session)
+    seconds = time.perf_counter() - started
+    return {'created': rows, 'seconds': round(seconds, 3), 'rows_per_second': round(rows / seconds)}
+
+
+async def measure_export(file_format: str) -> dict:
+    started = time.perf_counter()
+    with tempfile.TemporaryFile() as file:
+        writer = ProductFileWriter(file, file_format)
+        async with async_sessionmaker() as session:
+            exported = await product_actions.export_products(writer=writer, session=session, username=ADMIN_USERNAME)
+        writer.close()
+        size = file.tell()
+    seconds = time.perf_counter() - started
+    return {
+        'format': file_format,
+        'exported': exported,
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(exported / seconds)
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    if args.reset:
+        await reset()
+
+    data = generate_csv(args.rows)
+    results = {
+        'date': datetime.datetime.now().isoformat(),
+        'rows': args.rows,
+        'batch_size': config.IMPORT_BATCH_SIZE,
+        'file_bytes': len(data),
+        'parsing': measure_parsing(data)
+    }
+    try:
+        results['import'] = await measure_import(data)
+        logging.info(f"IMPORT: {results['import']['rows_per_second']} ROWS/S")
+        if args.baseline_rows:
+            results['one_by_one'] = await measure_one_by_one(args.baseline_rows)
+            logging.info(f"ONE BY ONE: {results['one_by_one']['rows_per_second']} ROWS/S")
+            results['speedup'] = round(
+                results['import']['rows_per_second'] / results['one_by_one']['rows_per_second'], 1
+            )
+        results['export'] = [await measure_export(file_format) for file_format in ('csv', 'json')]
+    finally:
+        await engine.dispose()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000, help='rows of the imported file')
+    parser.add_argument('--baseline-rows', type=int, default=1000, help='products created one by one, 0 to skip')
+    parser.add_argument('--reset', action='store_true', help='recreate the tables and flush the cache database')
+    parser.add_argument('--output', help='file for the JSON results, stdout if not given')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
@@ -0,0 +1,359 @@
+"""
+End-to-end load test of the bot. The dispatcher with all handlers and middlewares is fed
+with updates of virtual users, while the Bot API is replaced by a local aiohttp server,
+Postgres and Redis are the ones from the .env (docker-compose up -d starts them).
+
+Every step of the scenario is done by all the users at once before the next step starts,
+so the Bot API calls and the DB/Redis round trips of a step can be counted per action:
+
+    python -m benchmarks.load_test --users 1000 --concurrency 100 --reset --output load.json
+
+--reset drops and creates the tables and flushes the cache database, never run it against real data
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Optional
+
+# any well formed token, the requests never leave the machine
+os.environ.setdefault('API_TOKEN', '123456:load-test-token')
+# the fake Bot API has no rate limits, set it to true to measure the bot together with its own limits
+os.environ.setdefault('BOT_SCHEDULER_ENABLED', 'false')
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
+from aiohttp import web
+from aioredis.connection import Connection
+from sqlalchemy import event, insert
+
+import config
+from app import on_startup, on_shutdown
+from database.models import Base, Product
+from handlers import dp
+from loader import engine, redis_cache
+
+FIRST_USER_ID = 10 ** 9
+PRODUCT_IMAGE = 'media/Box.png'
+
+
+class FakeBotAPI:
+    """
+    Answers Bot API methods the way Telegram does and keeps the messages of every chat,
+    so virtual users can press the buttons of the messages they got
+    """
+
+    def __init__(self) -> None:
+        self.calls = Counter()
+        self.chats = defaultdict(dict)
+        self._message_ids = defaultdict(itertools.count)
+        self._file_ids = itertools.count()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = await request.post()
+        answer = getattr(self, f'_{method.lower()}', None)
+        result = answer(params) if answer is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _new_message(self, params, **fields) -> dict:
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids[chat_id]) + 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **fields
+        }
+        if params.get('reply_markup'):
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        self.chats[chat_id][message['message_id']] = message
+        return message
+
+    def _photo(self, photo) -> list[dict]:
+        # uploaded files get a new file_id, file_ids are sent back as is
+        if not isinstance(photo, str) or photo.startswith('attach://'):
+            photo = f'photo-{next(self._file_ids)}'
+        return [{'file_id': photo, 'file_unique_id': photo, 'width': 1280, 'height': 1280}]
+
+    def _getme(self, params) -> dict:
+        return {'id': 1, 'is_bot': True, 'first_name': 'Load test', 'username': 'load_test_bot'}
+
+    def _sendmessage(self, params) -> dict:
+        return self._new_message(params, text=params['text'])
+
+    def _sendphoto(self, params) -> dict:
+        return self._new_message(params, photo=self._photo(params['photo']), caption=params.get('caption'))
+
+    def _sendmediagroup(self, params) -> list[dict]:
+        return [
+            self._new_message({'chat_id': params['chat_id']}, photo=self._photo(media['media']),
+                              caption=media.get('caption'))
+            for media in json.loads(params['media'])
+        ]
+
+    def _edit(self, params, **fields) -> dict:
+        message = self.chats[int(params['chat_id'])].get(int(params['message_id']))
+        if message is None:
+            error = {'ok': False, 'error_code': 400, 'description': 'Bad Request: message to edit not found'}
+            raise web.HTTPBadRequest(text=json.dumps(error), content_type='application/json')
+        message.update(fields)
+        message['reply_markup'] = json.loads(params['reply_markup']) if params.get('reply_markup') else None
+        return message
+
+    def _editmessagemedia(self, params) -> dict:
+        media = json.loads(params['media'])
+        return self._edit(params, photo=self._photo(media['media']), caption=media.get('caption'))
+
+    def _editmessagereplymarkup(self, params) -> dict:
+        return self._edit(params)
+
+    def _deletemessage(self, params) -> bool:
+        self.chats[int(params['chat_id'])].pop(int(params['message_id']), None)
+        return True
+
+    def _deletemessages(self, params) -> bool:
+        for message_id in json.loads(params['message_ids']):
+            self.chats[int(params['chat_id'])].pop(message_id, None)
+        return True
+
+
+class RoundTrips:
+    """
+    Counts statements sent to Postgres and commands (or pipelines) sent to Redis
+    """
+
+    def __init__(self) -> None:
+        self.db = 0
+        self.redis = 0
+
+    def install(self) -> None:
+        event.listen(engine.sync_engine, 'before_cursor_execute', self._on_execute)
+        send_packed_command = Connection.send_packed_command
+
+        async def counted_send_packed_command(connection, *args, **kwargs):
+            self.redis += 1
+            return await send_packed_command(connection, *args, **kwargs)
+
+        Connection.send_packed_command = counted_send_packed_command
+
+    def _on_execute(self, *args) -> None:
+        self.db += 1
+
+
+class VirtualUser:
+    _update_ids = itertools.count(1)
+
+    def __init__(self, number: int, fake_api: FakeBotAPI) -> None:
+        self.user = {
+            'id': FIRST_USER_ID + number,
+            'is_bot': False,
+            'first_name': f'User {number}',
+            'username': f'load_user_{number}'
+        }
+        self.fake_api = fake_api
+
+    @property
+    def chat(self) -> dict:
+        # users are created from the chat of /start, so it has to carry the names of the user
+        return {
+            'id': self.user['id'],
+            'type': 'private',
+            'username': self.user['username'],
+            'first_name': self.user['first_name']
+        }
+
+    def command(self, text: str) -> types.Update:
+        message_id = 10 ** 6 + next(self._update_ids)
+        return types.Update.to_object({
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': self.chat,
+                'from': self.user,
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+            }
+        })
+
+    def press(self, callback_data: str, text: Optional[str] = None) -> Optional[types.Update]:
+        """
+        :param callback_data: data or prefix of the data of a button in the chat
+        :param text: text of the button, if buttons differ only by the data after the prefix
+        :return: callback query of the latest message with such button, None if there is no such message
+        """
+        messages = self.fake_api.chats[self.user['id']]
+        for message in reversed(list(messages.values())):
+            for row in (message.get('reply_markup') or {}).get('inline_keyboard', []):
+                for button in row:
+                    if button.get('callback_data', '').startswith(callback_data) and text in (None, button['text']):
+                        return types.Update.to_object({
+                            'update_id': next(self._update_ids),
+                            'callback_query': {
+                                'id': str(next(self._update_ids)),
+                                'from': self.user,
+                                'chat_instance': str(self.user['id']),
+                                'message': message,
+                                'data': button['callback_data']
+                            }
+                        })
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)) - 1, 0)]
+
+
+async def run_step(action: str, users: list[VirtualUser], make_update: Callable[[VirtualUser], Optional[types.Update]],
+                   concurrency: int, fake_api: FakeBotAPI, round_trips: RoundTrips) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors, skipped = [], 0, 0
+    calls_before, db_before, redis_before = fake_api.calls.copy(), round_trips.db, round_trips.redis
+
+    async def act(user: VirtualUser) -> None:
+        nonlocal errors, skipped
+        update = make_update(user)
+        if update is None:
+            skipped += 1
+            return
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await dp.process_update(update)
+            except Exception as error:
+                errors += 1
+                logging.warning(f'{action.upper()} OF {user.user["username"]} FAILED: {error!r}')
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(act(user) for user in users))
+    duration = time.perf_counter() - started
+    # messages of the step are deleted in background
+    await asyncio.sleep(config.MESSAGE_CLEANER_DELAY * 2)
+
+    calls = fake_api.calls - calls_before
+    done = max(len(latencies), 1)
+    return {
+        'action': action,
+        'count': len(latencies),
+        'errors': errors,
+        'skipped': skipped,
+        'duration': duration,
+        'throughput': len(latencies) / duration if duration else 0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5) * 1000 if latencies else None,
+            'p95': percentile(latencies, 0.95) * 1000 if latencies else None,
+            'p99': percentile(latencies, 0.99) * 1000 if latencies else None,
+            'max': max(latencies) * 1000 if latencies else None
+        },
+        'per_action': {
+            'bot_api_calls': sum(calls.values()) / done,
+            'bot_api_methods': {method: count / done for method, count in sorted(calls.items())},
+            'db_round_trips': (round_trips.db - db_before) / done,
+            'redis_round_trips': (round_trips.redis - redis_before) / done
+        }
+    }
+
+
+def scenario(flips: int) -> list[tuple[str, Callable[[VirtualUser], Optional[types.Update]]]]:
+    steps = [
+        ('start', lambda user: user.command('/start')),
+        ('show_products', lambda user: user.command('/show_products')),
+    ]
+    steps += [('product_right', lambda user: user.press('page:product:', text='>'))] * flips
+    steps += [
+        ('product_left', lambda user: user.press('page:product:', text='<')),
+        ('add_to_basket', lambda user: user.press('product_to_basket:add_product_to_basket')),
+        ('basket', lambda user: user.command('/basket')),
+        ('basket_right', lambda user: user.press('page:basket:', text='>')),
+    ]
+    return steps
+
+
+async def reset(products: int) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(Product), [
+            {
+                'name': f'product {i}',
+                'description': f'description of the product {i}',
+                'image_path': PRODUCT_IMAGE,
+                'created_date': datetime.date.today()
+            }
+            for i in range(products)
+        ])
+    await redis_cache.flushdb()
+
+
+async def main(args: argparse.Namespace) -> dict:
+    if args.reset:
+        await reset(args.products)
+
+    fake_api = FakeBotAPI()
+    runner = web.AppRunner(fake_api.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.api_port)
+    await site.start()
+
+    round_trips = RoundTrips()
+    round_trips.install()
+    dp.bot.server = TelegramAPIServer.from_base(f'http://127.0.0.1:{args.api_port}')
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await on_startup(dp)
+
+    users = [VirtualUser(number, fake_api) for number in range(args.users)]
+    steps = []
+    try:
+        for action, make_update in scenario(args.flips):
+            step = await run_step(action, users, make_update, args.concurrency, fake_api, round_trips)
+            logging.info(f'{action.upper()}: {step["throughput"]:.1f}/s, P95 {step["latency_ms"]["p95"]} MS')
+            steps.append(step)
+    finally:
+        await on_shutdown(dp)
+        await (await dp.bot.get_session()).close()
+        await runner.cleanup()
+
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'render_mode': config.PAGE_RENDER_MODE,
+        'product_page_size': config.PRODUCT_PAGE_SIZE,
+        'basket_page_size': config.BASKET_PAGE_SIZE,
+        'basket_write_behind': config.BASKET_WRITE_BEHIND,
+        'steps': steps
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='updates processed at once')
+    parser.add_argument('--flips', type=int, default=3, help='page flips to the right per user')
+    parser.add_argument('--products', type=int, default=1000, help='catalog size created by --reset')
+    parser.add_argument('--reset', action='store_true', help='recreate the tables and flush the cache database')
+    parser.add_argument('--api-port', type=int, default=8081, help='port of the fake Bot API')
+    parser.add_argument('--output', help='file for the JSON results, stdout if not given')
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
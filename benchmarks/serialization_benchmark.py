@@ -0,0 +1,97 @@
+"""
+Compares the old per-object serialization (hydrated ORM objects, one pydantic model per object)
+with the column-projected batch path of Actions.serialize.
+Runs on an in-memory SQLite database, so nothing but the requirements is needed:
+
+    python -m benchmarks.serialization_benchmark --rows 1000 10000 100000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import time
+
+from sqlalchemy import create_engine, select, insert
+from sqlalchemy.orm import Session
+
+from actions.basket_actions.basket_actions import BasketActions
+from actions.product_actions.product_actions import ProductActions
+from database.models import Base, Product
+
+
+def per_object_serialize(serializer_class, objects) -> list[dict]:
+    return [serializer_class(**object.__dict__).dict() for object in objects]
+
+
+def measure(function, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(rows: int, repeat: int) -> list[dict]:
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.execute(insert(Product), [
+            {
+                'name': f'product {i}',
+                'description': f'description of the product {i}',
+                'image_path': 'media/Box.png',
+                'created_date': datetime.date.today()
+            }
+            for i in range(rows)
+        ])
+        session.commit()
+
+    results = []
+    for actions in (ProductActions, BasketActions):
+        serializer_class = actions.serializer_class
+        columns = [getattr(Product, column) for column in actions.serializer_fields()]
+
+        def old_path():
+            with Session(engine) as session:
+                per_object_serialize(serializer_class, session.scalars(select(Product)).all())
+
+        def new_path():
+            with Session(engine) as session:
+                asyncio.run(actions.serialize(session.execute(select(*columns)).mappings().all()))
+
+        old_seconds, new_seconds = measure(old_path, repeat), measure(new_path, repeat)
+        results.append({
+            'serializer': serializer_class.__name__,
+            'rows': rows,
+            'per_object_seconds': round(old_seconds, 4),
+            'batch_seconds': round(new_seconds, 4),
+            'speedup': round(old_seconds / new_seconds, 2)
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write results into this file')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        for result in run(rows, args.repeat):
+            results.append(result)
+            print(
+                f"{result['serializer']:<26} {result['rows']:>7} rows: "
+                f"per object {result['per_object_seconds']:.4f}s, batch {result['batch_seconds']:.4f}s, "
+                f"x{result['speedup']}"
+            )
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
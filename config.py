@@ -14,3 +14,106 @@ API_TOKEN = os.getenv('API_TOKEN')
 POSTGRES_DB = os.getenv('POSTGRES_DB')
 POSTGRES_USER = os.getenv('POSTGRES_USER')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
+POSTGRES_PORT = int(os.getenv('POSTGRES_PORT', 5432))
+# product reads that are not cached by catalog version go to the read-only replica when it is given
+POSTGRES_REPLICA_HOST = os.getenv('POSTGRES_REPLICA_HOST')
+POSTGRES_REPLICA_PORT = int(os.getenv('POSTGRES_REPLICA_PORT', 5432))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# seconds, connections are reopened before a proxy or the server drops them
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 30 * 60))
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', 60 * 60))
+
+# 'polling' or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+HEALTH_PATH = os.getenv('HEALTH_PATH', '/health')
+
+# how many Telegram requests of one page flip are sent at once
+PAGE_REQUESTS_CONCURRENCY = int(os.getenv('PAGE_REQUESTS_CONCURRENCY', 4))
+
+# an admin flag changed in the database by hand and not by permissions.set_admin is seen not later than in this time
+PERMISSION_CACHE_TTL = int(os.getenv('PERMISSION_CACHE_TTL', 60))
+# other processes see a changed admin flag not later than in this time
+PERMISSION_LOCAL_CACHE_TTL = int(os.getenv('PERMISSION_LOCAL_CACHE_TTL', 30))
+PERMISSION_LOCAL_CACHE_SIZE = int(os.getenv('PERMISSION_LOCAL_CACHE_SIZE', 10000))
+
+# basket adds and removes are kept in Redis and flushed into Postgres in batches
+BASKET_WRITE_BEHIND = os.getenv('BASKET_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+BASKET_FLUSH_INTERVAL = float(os.getenv('BASKET_FLUSH_INTERVAL', 5))
+BASKET_FLUSH_BATCH = int(os.getenv('BASKET_FLUSH_BATCH', 500))
+
+# how long the message cleaner waits to collect more messages into one batch
+MESSAGE_CLEANER_DELAY = float(os.getenv('MESSAGE_CLEANER_DELAY', 0.5))
+
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', 'media/products_images')
+CATALOG_IMAGE_SIZE = int(os.getenv('CATALOG_IMAGE_SIZE', 1280))
+MEDIA_JPEG_QUALITY = int(os.getenv('MEDIA_JPEG_QUALITY', 85))
+MEDIA_PROCESSES = int(os.getenv('MEDIA_PROCESSES', 2))
+# images outside of MEDIA_ROOT whose content digests are kept in memory
+MEDIA_DIGEST_CACHE_SIZE = int(os.getenv('MEDIA_DIGEST_CACHE_SIZE', 1000))
+
+# 'messages' - a product per message, 'album' - a page is one media group with numbered buttons under it
+PAGE_RENDER_MODE = os.getenv('PAGE_RENDER_MODE', 'messages')
+PRODUCT_PAGE_SIZE = int(os.getenv('PRODUCT_PAGE_SIZE', 2))
+BASKET_PAGE_SIZE = int(os.getenv('BASKET_PAGE_SIZE', 2))
+# outbound Bot API requests are kept within Telegram limits: messages per second of the bot and of a chat
+BOT_SCHEDULER_ENABLED = os.getenv('BOT_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+BOT_GLOBAL_RATE = float(os.getenv('BOT_GLOBAL_RATE', 30))
+BOT_CHAT_RATE = float(os.getenv('BOT_CHAT_RATE', 1))
+# requests of a chat sent at once before its rate applies, a page flip edits all the messages of the page
+BOT_CHAT_BURST = int(os.getenv('BOT_CHAT_BURST', 20))
+BOT_MAX_RETRIES = int(os.getenv('BOT_MAX_RETRIES', 3))
+BOT_RETRY_JITTER = float(os.getenv('BOT_RETRY_JITTER', 1))
+BOT_SCHEDULER_CHATS_SIZE = int(os.getenv('BOT_SCHEDULER_CHATS_SIZE', 10000))
+
+# announces of new products are sent in batches and not faster than this rate, below the global limit
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 50))
+# users read by one query, the session is closed before they are sent to
+BROADCAST_WINDOW = int(os.getenv('BROADCAST_WINDOW', 5000))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', 60))
+# a failed broadcast is resumed from its checkpoint after the delay, the delay doubles with every failure
+BROADCAST_RETRY_DELAY = float(os.getenv('BROADCAST_RETRY_DELAY', 10))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', 5))
+
+# products files of /import_products are validated and copied into the catalog by batches
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 5000))
+IMPORT_REPORTED_ERRORS = int(os.getenv('IMPORT_REPORTED_ERRORS', 10))
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 5000))
+# progress messages of imports and exports are edited not more often than this
+TRANSFER_PROGRESS_INTERVAL = float(os.getenv('TRANSFER_PROGRESS_INTERVAL', 3))
+
+# callbacks of a user per second handled by a handler without its own rule
+CALLBACK_RATE_LIMIT = float(os.getenv('CALLBACK_RATE_LIMIT', 5))
+# page switcher clicks within the debounce time are handled as the last of them
+PAGINATION_RATE_LIMIT = float(os.getenv('PAGINATION_RATE_LIMIT', 3))
+PAGINATION_DEBOUNCE = float(os.getenv('PAGINATION_DEBOUNCE', 0.3))
+THROTTLING_STATE_SIZE = int(os.getenv('THROTTLING_STATE_SIZE', 10000))
+# rendered captions and keyboards of products kept in the process
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 5000))
+if PAGE_RENDER_MODE == 'album':
+    # a media group holds not more than 10 photos
+    PRODUCT_PAGE_SIZE = min(PRODUCT_PAGE_SIZE, 10)
+    BASKET_PAGE_SIZE = min(BASKET_PAGE_SIZE, 10)
+
+# metrics in Prometheus text format are served on a local port
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+# results of a search query are cached for a short time and shown by pages
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 60))
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 50))
+SEARCH_QUERY_MAX_LENGTH = int(os.getenv('SEARCH_QUERY_MAX_LENGTH', 100))
+
+# inline query answers are cached by Telegram for this time
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+INLINE_RESULTS_LIMIT = int(os.getenv('INLINE_RESULTS_LIMIT', 20))
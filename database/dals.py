@@ -1,10 +1,16 @@
 import logging
+from typing import AsyncIterator, Optional, Sequence, Union
 
-from sqlalchemy import select
+from sqlalchemy import select, func, text, update, delete, exists, or_, and_, tuple_, cast, Row, RowMapping
+from sqlalchemy.dialects.postgresql import insert, REGCONFIG
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from database.models import User, Product, Basket
+from database.models import User, Product, Basket, association_basket_table, SEARCH_CONFIG
+
+BASKET_PAGE_COLUMNS = ('product_id', 'name', 'description', 'image_path', 'created_date')
+PRODUCT_COPY_COLUMNS = ('name', 'description', 'image_path', 'created_date')
+# key of the advisory lock held by the transaction of a products import
+PRODUCTS_IMPORT_LOCK_ID = 7201
 
 
 class BasketDAL:
@@ -16,28 +22,144 @@ class BasketDAL:
         new_basket = Basket()
         return new_basket
 
-    async def remove_product_from_basket(self, user: User, product: Product) -> Basket:
-        basket = user.basket
-        basket.products.remove(product)
-        self.session.add(basket)
-        await self.session.flush()
-        logging.info(f'REMOVED {product} FROM {basket}')
-        return basket
+    @staticmethod
+    def _user_basket_id(username: str):
+        return select(Basket.basket_id). \
+            join(User, User.user_id == Basket.user_id). \
+            where(User.username == username). \
+            scalar_subquery()
 
-    async def add_product_to_basket(self, user: User, product: Product) -> Basket:
-        basket = user.basket
-        basket.products.append(product)
-        self.session.add(basket)
-        await self.session.flush()
-        logging.info(f'ADDED {product} INTO {basket}')
-        return basket
+    async def has_product(self, username: str, product_id: int) -> bool:
+        """
+        Checks membership by one indexed EXISTS query, the basket is not loaded
+        :param username: str
+        :param product_id: int
+        :return: bool
+        """
+        query = select(
+            exists().where(
+                association_basket_table.c.basket_id == self._user_basket_id(username),
+                association_basket_table.c.product_id == product_id
+            )
+        )
+        result = await self.session.execute(query)
+        return result.scalar()
+
+    async def add_product_to_basket(self, username: str, product_id: int) -> bool:
+        """
+        :return: bool - False if the product was already in the basket or does not exist
+        """
+        products = select(Basket.basket_id, Product.product_id). \
+            join(User, User.user_id == Basket.user_id). \
+            where(User.username == username, Product.product_id == product_id)
+        query = insert(association_basket_table). \
+            from_select(['basket_id', 'product_id'], products). \
+            on_conflict_do_nothing()
+        result = await self.session.execute(query)
+        logging.info(f'ADDED PRODUCT {product_id} INTO BASKET OF {username}')
+        return result.rowcount > 0
+
+    async def remove_product_from_basket(self, username: str, product_id: int) -> bool:
+        """
+        :return: bool - False if there was no such product in the basket
+        """
+        query = delete(association_basket_table).where(
+            association_basket_table.c.basket_id == self._user_basket_id(username),
+            association_basket_table.c.product_id == product_id
+        )
+        result = await self.session.execute(query)
+        logging.info(f'REMOVED PRODUCT {product_id} FROM BASKET OF {username}')
+        return result.rowcount > 0
+
+    def _basket_products_filter(self, username: str, added_ids: Sequence[int] = (),
+                                removed_ids: Sequence[int] = ()):
+        """
+        :param added_ids: products that are in the basket, but are not written into association_table yet
+        :param removed_ids: products that are removed from the basket, but are still in association_table
+        """
+        in_basket = Product.product_id.in_(
+            select(association_basket_table.c.product_id).
+            where(association_basket_table.c.basket_id == self._user_basket_id(username))
+        )
+        if added_ids:
+            in_basket = or_(in_basket, Product.product_id.in_(added_ids))
+        if removed_ids:
+            in_basket = and_(in_basket, Product.product_id.not_in(removed_ids))
+        return in_basket
+
+    async def get_basket_page(self, username: str, limit: int, after_id: Optional[int] = None,
+                              before_id: Optional[int] = None, added_ids: Sequence[int] = (),
+                              removed_ids: Sequence[int] = (),
+                              columns: Sequence[str] = BASKET_PAGE_COLUMNS) -> list[RowMapping]:
+        """
+        Keyset pagination over the basket products by one query,
+        only the columns of the basket page are selected
+        :param username: str
+        :param limit: int - page size
+        :param after_id: int - return products that go after this product
+        :param before_id: int - return products that go before this product
+        :param added_ids: not flushed products of the basket
+        :param removed_ids: not flushed removals from the basket
+        :param columns: names of the selected Product columns
+        :return: list[RowMapping] ordered by product_id
+        """
+        columns = [getattr(Product, column) for column in columns]
+        query = select(*columns). \
+            where(self._basket_products_filter(username, added_ids=added_ids, removed_ids=removed_ids))
+        if before_id is not None:
+            query = query.where(Product.product_id < before_id).order_by(Product.product_id.desc())
+        else:
+            if after_id is not None:
+                query = query.where(Product.product_id > after_id)
+            query = query.order_by(Product.product_id)
+        result = await self.session.execute(query.limit(limit))
+        products = result.mappings().all()
+        if before_id is not None:
+            products = list(reversed(products))
+        return products
 
-    async def get_user_basket(self, user_id: int) -> list[Product]:
-        query = select(Basket).where(Basket.user_id == user_id)
+    async def count_basket_products(self, username: str, added_ids: Sequence[int] = (),
+                                    removed_ids: Sequence[int] = ()) -> int:
+        query = select(func.count()). \
+            select_from(Product). \
+            where(self._basket_products_filter(username, added_ids=added_ids, removed_ids=removed_ids))
         result = await self.session.execute(query)
-        products = result.fetchone()
-        if products is not None:
-            return products[0].products
+        return result.scalar()
+
+    async def get_basket_ids(self, usernames: Sequence[str]) -> dict[str, int]:
+        query = select(User.username, Basket.basket_id). \
+            join(User, User.user_id == Basket.user_id). \
+            where(User.username.in_(usernames))
+        result = await self.session.execute(query)
+        return {username: basket_id for username, basket_id in result.all()}
+
+    async def bulk_add_products(self, rows: Sequence[tuple[int, int]]) -> None:
+        """
+        :param rows: (basket_id, product_id), rows of products that do not exist are skipped
+        """
+        if not rows:
+            return
+        result = await self.session.execute(
+            select(Product.product_id).where(Product.product_id.in_({product_id for _, product_id in rows}))
+        )
+        existing_ids = set(result.scalars().all())
+        values = [
+            {'basket_id': basket_id, 'product_id': product_id}
+            for basket_id, product_id in rows if product_id in existing_ids
+        ]
+        if values:
+            await self.session.execute(insert(association_basket_table).values(values).on_conflict_do_nothing())
+
+    async def bulk_remove_products(self, rows: Sequence[tuple[int, int]]) -> None:
+        """
+        :param rows: (basket_id, product_id)
+        """
+        if not rows:
+            return
+        query = delete(association_basket_table).where(
+            tuple_(association_basket_table.c.basket_id, association_basket_table.c.product_id).in_(rows)
+        )
+        await self.session.execute(query)
 
 
 class UserDAL:
@@ -50,6 +172,7 @@ class UserDAL:
             username=message['chat'].get('username'),
             first_name=message['chat'].get('first_name'),
             last_name=message['chat'].get('last_name'),
+            chat_id=message['chat'].get('id'),
             basket=basket
         )
         self.session.add_all([basket, new_user])
@@ -58,14 +181,47 @@ class UserDAL:
         return new_user
 
     async def get_user_by_username(self, username: str) -> User:
-        query = select(User). \
-            where(User.username == username). \
-            options(selectinload(User.basket).selectinload(Basket.products))
+        query = select(User).where(User.username == username)
         result = await self.session.execute(query)
         user_rows = result.fetchone()
         if user_rows is not None:
             return user_rows[0]
 
+    async def get_user_roles(self, username: str) -> Optional[tuple[int, bool]]:
+        """
+        Fetches only the columns needed for permission checks
+        :param username: str
+        :return: (user_id, is_admin)
+        """
+        query = select(User.user_id, User.is_admin).where(User.username == username)
+        result = await self.session.execute(query)
+        return result.first()
+
+    async def set_admin(self, username: str, is_admin: bool) -> None:
+        query = update(User).where(User.username == username).values(is_admin=is_admin)
+        await self.session.execute(query)
+        logging.info(f'SET is_admin={is_admin} FOR {username}')
+
+    async def set_chat_id(self, username: str, chat_id: int) -> None:
+        query = update(User).where(User.username == username).values(chat_id=chat_id)
+        await self.session.execute(query)
+
+    async def get_chat_ids(self, after_id: int, limit: int) -> Sequence[Row]:
+        """
+        Users with known chats by keyset on user_id
+        :param after_id: int - keyset, users after this user_id
+        :param limit: int - users of the query at most
+        :return: rows of (user_id, chat_id) ordered by user_id
+        """
+        query = (
+            select(User.user_id, User.chat_id)
+            .where(User.user_id > after_id, User.chat_id.is_not(None))
+            .order_by(User.user_id)
+            .limit(limit)
+        )
+        result = await self.session.execute(query)
+        return result.all()
+
 
 class ProductDAL:
     def __init__(self, session: AsyncSession) -> None:
@@ -78,12 +234,108 @@ class ProductDAL:
         logging.info(f'CREATED NEW {new_product}')
         return new_product
 
+    async def lock_products_import(self) -> None:
+        """
+        Takes the transaction lock of imports, so two imports do not run at once. Besides, it begins
+        the transaction of the driver connection, which COPY of copy_products has to be a part of
+        """
+        await self.session.execute(select(func.pg_advisory_xact_lock(PRODUCTS_IMPORT_LOCK_ID)))
+
+    async def copy_products(self, rows: Sequence[tuple]) -> None:
+        """
+        Inserts the rows by COPY of asyncpg, by one multi-row insert with other drivers
+        :param rows: tuples of PRODUCT_COPY_COLUMNS
+        """
+        if not rows:
+            return
+        connection = await self.session.connection()
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        if hasattr(driver_connection, 'copy_records_to_table'):
+            await driver_connection.copy_records_to_table(
+                Product.__tablename__, records=rows, columns=PRODUCT_COPY_COLUMNS
+            )
+        else:
+            await self.session.execute(insert(Product).values([dict(zip(PRODUCT_COPY_COLUMNS, row)) for row in rows]))
+
+    async def stream_products(self, columns: Sequence[str], batch_size: int) -> AsyncIterator[Sequence[RowMapping]]:
+        """
+        Streams the whole catalog by a server-side cursor, ordered by product_id
+        :param columns: names of the selected columns
+        :param batch_size: int - rows fetched from the cursor at once
+        """
+        query = select(*[getattr(Product, column) for column in columns]). \
+            order_by(Product.product_id). \
+            execution_options(yield_per=batch_size)
+        result = await self.session.stream(query)
+        async for batch in result.mappings().partitions():
+            yield batch
+
     async def get_all_products(self) -> list[Product]:
         query = select(Product)
         result = await self.session.execute(query)
         products = result.scalars().all()
         return products
 
+    async def get_products_page(self, limit: int, after_id: Optional[int] = None, before_id: Optional[int] = None,
+                                columns: Optional[Sequence[str]] = None) -> Union[list[Product], list[RowMapping]]:
+        """
+        Keyset pagination over product_id
+        :param limit: int - page size
+        :param after_id: int - return products that go after this product
+        :param before_id: int - return products that go before this product
+        :param columns: names of the selected columns, whole Product objects are returned without them
+        :return: list[Product] or list[RowMapping] ordered by product_id
+        """
+        if columns is not None:
+            query = select(*[getattr(Product, column) for column in columns])
+        else:
+            query = select(Product)
+        if before_id is not None:
+            query = query.where(Product.product_id < before_id).order_by(Product.product_id.desc())
+        else:
+            if after_id is not None:
+                query = query.where(Product.product_id > after_id)
+            query = query.order_by(Product.product_id)
+        result = await self.session.execute(query.limit(limit))
+        products = result.mappings().all() if columns is not None else result.scalars().all()
+        if before_id is not None:
+            products = list(reversed(products))
+        return products
+
+    async def count_products(self, estimate: bool = False) -> int:
+        """
+        :param estimate: bool - take the planner estimate from pg_class instead of count(*)
+        :return: int
+        """
+        if estimate:
+            query = text("SELECT reltuples::bigint FROM pg_class WHERE oid = '\"Product\"'::regclass")
+            result = await self.session.execute(query)
+            estimated_count = result.scalar()
+            # reltuples is -1 (or 0 on old Postgres) until the table is analyzed
+            if estimated_count is not None and estimated_count > 0:
+                return estimated_count
+
+        result = await self.session.execute(select(func.count()).select_from(Product))
+        return result.scalar()
+
+    async def search_products(self, search_query: str, limit: int, columns: Sequence[str]) -> list[RowMapping]:
+        """
+        Full text search over names and descriptions by the GIN index of search_vector
+        :param search_query: str - web search syntax: words, "phrases", -excluded, or
+        :param limit: int
+        :param columns: names of the selected columns
+        :return: list[RowMapping] - the most relevant products first
+        """
+        ts_query = func.websearch_to_tsquery(cast(SEARCH_CONFIG, REGCONFIG), search_query)
+        rank = func.ts_rank_cd(Product.search_vector, ts_query)
+        query = select(*[getattr(Product, column) for column in columns]). \
+            where(Product.search_vector.op('@@')(ts_query)). \
+            order_by(rank.desc(), Product.product_id). \
+            limit(limit)
+        result = await self.session.execute(query)
+        return result.mappings().all()
+
     async def get_product_by_id(self, product_id: int) -> Product:
         query = select(Product).where(Product.product_id == product_id)
         result = await self.session.execute(query)
@@ -0,0 +1,30 @@
+import asyncio
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+import config
+
+
+def create_engine(host: str, port: int) -> AsyncEngine:
+    return create_async_engine(
+        f"postgresql+asyncpg://{config.POSTGRES_USER}:{config.POSTGRES_PASSWORD}@{host}:{port}/{config.POSTGRES_DB}",
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        pool_recycle=config.DB_POOL_RECYCLE
+    )
+
+
+async def warm_up(engine: AsyncEngine, connections: int = config.DB_POOL_SIZE) -> None:
+    """
+    Opens the connections of the pool before the first updates come,
+    connections are checked out at once, so each of them is a new one
+    """
+    async def connect() -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+
+    await asyncio.gather(*(connect() for _ in range(connections)))
+    logging.info(f'OPENED {connections} CONNECTIONS TO {engine.url.host}')
@@ -1,7 +1,11 @@
 import datetime
 
-from sqlalchemy import Column, String, Integer, Text, Date, Boolean, ForeignKey, Table
-from sqlalchemy.orm import DeclarativeBase, relationship, backref
+from sqlalchemy import Column, String, Integer, BigInteger, Text, Date, Boolean, ForeignKey, Table, Index, DDL, event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import DeclarativeBase, relationship, backref, deferred
+
+# text search configuration of the products search, names are weighted over descriptions
+SEARCH_CONFIG = 'russian'
 
 
 class Base(DeclarativeBase):
@@ -11,8 +15,8 @@ class Base(DeclarativeBase):
 association_basket_table = Table(
     'association_table',
     Base.metadata,
-    Column('basket_id', ForeignKey('Basket.basket_id')),
-    Column('product_id', ForeignKey('Product.product_id'))
+    Column('basket_id', ForeignKey('Basket.basket_id'), primary_key=True),
+    Column('product_id', ForeignKey('Product.product_id'), primary_key=True, index=True)
 )
 
 
@@ -20,7 +24,7 @@ class Basket(Base):
     __tablename__ = 'Basket'
 
     basket_id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('User.user_id'))
+    user_id = Column(Integer, ForeignKey('User.user_id'), unique=True, index=True)
     products = relationship('Product', secondary=association_basket_table, backref=backref('Basket'))
 
     def __repr__(self):
@@ -31,9 +35,11 @@ class User(Base):
     __tablename__ = 'User'
 
     user_id = Column(Integer, primary_key=True)
-    username = Column(String(15), nullable=False)
+    username = Column(String(15), nullable=False, index=True)
     first_name = Column(String(30), nullable=True)
     last_name = Column(String(30), nullable=True)
+    # private chat of the user, known since the user's first /start after it was added
+    chat_id = Column(BigInteger, nullable=True)
     is_admin = Column(Boolean, default=False)
     basket = relationship('Basket', uselist=False, backref=backref('User'))
 
@@ -49,6 +55,28 @@ class Product(Base):
     image_path = Column(String, default='media/Box.png', nullable=False)
     description = Column(Text, nullable=False)
     created_date = Column(Date, default=datetime.datetime.utcnow(), nullable=False)
+    # kept up to date by the product_search_vector_update trigger, the trigger and search exist only in Postgres
+    search_vector = deferred(Column(TSVECTOR().with_variant(Text(), 'sqlite'), nullable=True))
+
+    __table_args__ = (
+        Index('ix_Product_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     def __repr__(self):
         return f'<Product(id={self.product_id}, name={self.name}, description={self.description}, created_date={self.created_date})>'
+
+
+event.listen(Product.__table__, 'after_create', DDL(f"""
+    CREATE OR REPLACE FUNCTION product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+""").execute_if(dialect='postgresql'))
+event.listen(Product.__table__, 'after_create', DDL("""
+    CREATE TRIGGER product_search_vector_update BEFORE INSERT OR UPDATE OF name, description ON "Product"
+    FOR EACH ROW EXECUTE FUNCTION product_search_vector_update()
+""").execute_if(dialect='postgresql'))
@@ -0,0 +1,46 @@
+import logging
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class UnitOfWork:
+    """
+    One session per update: actions only flush, the session is committed once
+    when the handler is done and rolled back if the handler failed.
+    AsyncSession checks out a connection only on the first query,
+    so updates that never touch the database never take a connection from the pool
+    """
+    AFTER_COMMIT_KEY = 'after_commit'
+
+    @classmethod
+    def after_commit(cls, session: AsyncSession, callback: Callable[[], Awaitable]) -> None:
+        """
+        Registers a callback that is called only after the changes are committed,
+        for example invalidation of caches that must not see uncommitted data
+        """
+        session.info.setdefault(cls.AFTER_COMMIT_KEY, []).append(callback)
+
+    @classmethod
+    async def commit(cls, session: AsyncSession) -> None:
+        if session.in_transaction():
+            await session.commit()
+        for callback in session.info.pop(cls.AFTER_COMMIT_KEY, []):
+            await callback()
+
+    @classmethod
+    async def rollback(cls, session: AsyncSession) -> None:
+        session.info.pop(cls.AFTER_COMMIT_KEY, None)
+        if session.in_transaction():
+            await session.rollback()
+
+    @classmethod
+    async def complete(cls, session: AsyncSession, error: Optional[BaseException] = None) -> None:
+        try:
+            if error is None:
+                await cls.commit(session)
+            else:
+                logging.info(f'ROLLBACK OF {session} BECAUSE OF {error!r}')
+                await cls.rollback(session)
+        finally:
+            await session.close()
@@ -1,5 +1,8 @@
 from .basket_handler.basket_handler import dp
 from .user_handler.user_handler import dp
 from .product_handler.product_handler import dp
+from .product_file_handler.product_file_handler import dp
+from .search_handler.search_handler import dp
+from .inline_handler.inline_handler import dp
 
 __all__ = ['dp']
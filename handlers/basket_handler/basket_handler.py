@@ -3,58 +3,41 @@ import json
 from aiogram import types
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from actions.basket_actions.basket_actions import BasketActions
-from actions.user_actions.user_actions import UserActions
-from handlers.product_handler.services import ProductPages
-from keyboards.inline_keyboard import InlineKeyboard, callback_data_add_to_basket_or_delete
-from loader import dp, basket_actions, redis_cache, product_actions
+import config
+from handlers.product_handler.services import send_page, change_page, get_pages_data
+from keyboards.inline_keyboard import callback_data_add_to_basket_or_delete, callback_data_page
+from loader import dp, basket_actions, product_actions, redis_cache, message_ledger
+from middlewares.throttling_middleware import throttle
 
 CACHE_KEY = ':basket'
 
 
 @dp.message_handler(commands=['basket'])
 async def show_user_basket(message: types.Message, session: AsyncSession) -> None:
-    user = await UserActions.get_user_by_username(username=message.from_user.username, session=session)
-    user_basket_products = await basket_actions.get_user_basket(user_id=user.user_id, session=session)
-
-    json_data = {
-        'messages': [],
-        'tab_message': None,
-        'current_page': 0,
-        'products': user_basket_products
-    }
+    user_basket_products = await basket_actions.get_user_basket(username=message.from_user.username, session=session)
 
     if len(user_basket_products) == 0:
         msg = await message.answer('Ваша корзина пуста')
-        useless_messages = json.loads(await redis_cache.get(message.from_user.username + ':useless_messages'))
-        useless_messages.append(msg.message_id)
-        await redis_cache.set(message.from_user.username + ':useless_messages', json.dumps(useless_messages))
+        await message_ledger.add(message.from_user.username, msg.message_id)
         return
 
-    for product in user_basket_products[0]:
-        caption = f"""
-             <b>{product['name']}</b>
-             {product['description']}
-        """
-        product_message = await message.answer_photo(
-            open(f"{product['image_path']}", 'rb'),
-            caption=caption,
-            parse_mode='HTML',
-            reply_markup=await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
-                product_id=product['product_id'], delete_or_add='delete'
-            )
-        )
-        json_data['messages'].append(product_message.message_id)
+    pages = await basket_actions.count_pages(username=message.from_user.username, session=session)
+    # products of the basket are rendered from the cache of the current catalog version
+    catalog_version = await product_actions.get_catalog_version()
+    json_data = {
+        'messages': [],
+        'tab_message': None
+    }
 
-    tab_message = await message.answer(
-        'Переключалка',
-        reply_markup=await InlineKeyboard.generate_switcher_reply_markup(
-            current_page=1,
-            pages=len(user_basket_products),
-            callback_data=('basket_left', 'basket_right')
-        )
+    json_data = await send_page(
+        chat_id=message.chat.id,
+        data=json_data,
+        products=user_basket_products,
+        delete_or_add='delete',
+        pages=pages,
+        list_type='basket',
+        version=catalog_version
     )
-    json_data['tab_message'] = tab_message.message_id
 
     await redis_cache.set(
         message.from_user.username + CACHE_KEY,
@@ -64,90 +47,52 @@ async def show_user_basket(message: types.Message, session: AsyncSession) -> Non
 
 @dp.callback_query_handler(callback_data_add_to_basket_or_delete.filter(action='remove_product_from_basket'))
 async def remove_product_from_basket(call: types.CallbackQuery, callback_data: dict, session: AsyncSession) -> None:
-    user = await UserActions.get_user_by_username(username=call.from_user.username, session=session)
-    product = await product_actions.get_product_by_id(product_id=int(callback_data['product_id']), session=session)
-    if not (product in user.basket.products):
+    removed = await basket_actions.remove_product_from_basket(
+        username=call.from_user.username,
+        product_id=int(callback_data['product_id']),
+        session=session
+    )
+    if not removed:
         msg = await dp.bot.send_message(chat_id=call.message.chat.id, text='Такого товара уже нет в вашей корзине')
-        useless_messages = json.loads(await redis_cache.get(call.from_user.username + ':useless_messages'))
-        useless_messages.append(msg.message_id)
-        await redis_cache.set(call.from_user.username + ':useless_messages', json.dumps(useless_messages))
+        await message_ledger.add(call.from_user.username, msg.message_id)
     else:
-        new_user = await BasketActions.remove_product_from_basket(user=user, product=product, session=session)
         msg = await dp.bot.send_message(chat_id=call.message.chat.id, text='Товар удален из корзины')
-        useless_messages = json.loads(await redis_cache.get(call.from_user.username + ':useless_messages'))
-        useless_messages.append(msg.message_id)
-        await redis_cache.set(call.from_user.username + ':useless_messages', json.dumps(useless_messages))
-
-
-@dp.callback_query_handler(text=['basket_left'])
-async def basket_left(call: types.CallbackQuery) -> None:
-    current_page, pages = call.message.reply_markup.inline_keyboard[0][1].text.split('/')
-    products_previous_page = await ProductPages.get_previous_page(
-        username=call.from_user.username,
-        cache_key=CACHE_KEY,
-        delete_or_add='delete'
-    )
-
-    if products_previous_page is None:
+        await message_ledger.add(call.from_user.username, msg.message_id)
+
+
+@dp.callback_query_handler(callback_data_page.filter(list_type='basket'))
+@throttle(rate=config.PAGINATION_RATE_LIMIT, debounce=config.PAGINATION_DEBOUNCE)
+async def change_basket_page(call: types.CallbackQuery, callback_data: dict, session: AsyncSession) -> None:
+    """
+    Shows the page of the button, the basket is paged by keyset from the edge products of the shown page,
+    so the button stays right after products are added to or removed from the basket
+    """
+    data = await get_pages_data(call=call, cache_key=CACHE_KEY)
+    if data is None:
         return
 
-    data = products_previous_page['data']
-
-    if len(products_previous_page['create']) > 0:
-        await dp.bot.delete_message(
-            chat_id=call.message.chat.id, message_id=data['tab_message']
-        )
-
-    for form in products_previous_page['post']:
-        await dp.bot.edit_message_media(chat_id=call.message.chat.id, **form)
-
-    for form in products_previous_page['create']:
-        new_message = await dp.bot.send_photo(chat_id=call.message.chat.id, **form)
-        data['messages'].append(new_message.message_id)
-
-    if len(products_previous_page['create']) > 0:
-        tab_message = await dp.bot.send_message(
-            chat_id=call.message.chat.id,
-            text='Переключалка',
-            reply_markup=await InlineKeyboard.generate_switcher_reply_markup(
-                int(current_page) - 1, pages, callback_data=('basket_left', 'basket_right')
-            )
-        )
-    else:
-        tab_message = await call.message.edit_reply_markup(
-            await InlineKeyboard.generate_switcher_reply_markup(
-                int(current_page) - 1, pages, callback_data=('basket_left', 'basket_right')
-            )
-        )
-
-    data['tab_message'] = tab_message.message_id
-    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data))
-
-
-@dp.callback_query_handler(text=['basket_right'])
-async def basket_right(call: types.CallbackQuery) -> None:
-    current_page, pages = call.message.reply_markup.inline_keyboard[0][1].text.split('/')
-    products_next_page = await ProductPages.get_next_page(
-        username=call.from_user.username,
-        cache_key=CACHE_KEY,
-        delete_or_add='delete'
+    username = call.from_user.username
+    after_id, before_id = callback_data['after_id'], callback_data['before_id']
+    products = await basket_actions.get_user_basket(
+        username=username,
+        session=session,
+        after_id=int(after_id) if after_id else None,
+        before_id=int(before_id) if before_id else None
     )
-
-    if products_next_page is None:
+    if len(products) == 0:
+        await call.answer('Больше товаров нет')
         return
 
-    for form in products_next_page['post']:
-        await dp.bot.edit_message_media(chat_id=call.message.chat.id, **form)
-
-    for message in products_next_page['delete']:
-        await dp.bot.delete_message(chat_id=call.message.chat.id, message_id=message)
-
-    tab_message = await call.message.edit_reply_markup(
-        await InlineKeyboard.generate_switcher_reply_markup(
-            int(current_page) + 1, pages, callback_data=('basket_left', 'basket_right')
-        )
+    pages = await basket_actions.count_pages(username=username, session=session)
+    catalog_version = await product_actions.get_catalog_version()
+    data = await change_page(
+        call=call,
+        data=data,
+        products=products,
+        delete_or_add='delete',
+        page=int(callback_data['page']),
+        pages=pages,
+        list_type='basket',
+        version=catalog_version
     )
-
-    data = products_next_page['data']
-    data['tab_message'] = tab_message.message_id
-    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data))
+    await redis_cache.set(username + CACHE_KEY, json.dumps(data))
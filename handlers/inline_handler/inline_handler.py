@@ -0,0 +1,40 @@
+from aiogram import types
+
+import config
+from loader import dp, product_actions, product_index, media_registry
+
+
+# any state, so the FSM storage is not read on every keystroke
+@dp.inline_handler(state='*')
+async def inline_products(inline_query: types.InlineQuery) -> None:
+    # inline queries come on every keystroke, so they are answered from the index and never wait for Postgres,
+    # products created by other processes are loaded into the index in background
+    product_index.sync(await product_actions.get_catalog_version())
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    products = product_index.search(inline_query.query, limit=config.INLINE_RESULTS_LIMIT, offset=offset)
+    file_ids = await media_registry.get_file_ids([product['image_path'] for product in products])
+
+    results = []
+    for product, file_id in zip(products, file_ids):
+        caption = f"<b>{product['name']}</b>\n{product['description']}"
+        if file_id is not None:
+            results.append(types.InlineQueryResultCachedPhoto(
+                id=str(product['product_id']),
+                photo_file_id=file_id,
+                title=product['name'],
+                description=product['description'],
+                caption=caption,
+                parse_mode='HTML'
+            ))
+        else:
+            # inline photos are sent only by file_id or public url, images that were never uploaded go as text
+            results.append(types.InlineQueryResultArticle(
+                id=str(product['product_id']),
+                title=product['name'],
+                description=product['description'],
+                input_message_content=types.InputTextMessageContent(caption, parse_mode='HTML')
+            ))
+
+    next_offset = str(offset + len(products)) if len(products) == config.INLINE_RESULTS_LIMIT else ''
+    await inline_query.answer(results, cache_time=config.INLINE_CACHE_TIME, next_offset=next_offset)
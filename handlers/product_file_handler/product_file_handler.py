@@ -0,0 +1,167 @@
+import csv
+import tempfile
+import time
+import zipfile
+from typing import Awaitable, Callable
+
+import asyncpg
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.types import ContentType
+from aiogram.utils.exceptions import TelegramAPIError
+from sqlalchemy.exc import DataError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database.unit_of_work import UnitOfWork
+from exceptions.exceptions import PermissionDenied
+from loader import dp, product_actions, permission_service, media_store, message_ledger
+from permissions.product_permissions import PermissionAdmin
+from services.product_files import ImageResolver, ProductFileWriter, get_file_format, iter_products
+from state.states import ProductFileState
+
+# bots can not download bigger files by the Bot API
+DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+
+def progress_reporter(message: types.Message, template: str) -> Callable[..., Awaitable]:
+    """
+    :param message: types.Message - message that is edited with the progress
+    :param template: str - text of the progress, formatted with the arguments of the reporter
+    :return: coroutine function that edits the message not more often than config.TRANSFER_PROGRESS_INTERVAL
+    """
+    edited = time.monotonic()
+
+    async def report(*args) -> None:
+        nonlocal edited
+        if time.monotonic() - edited < config.TRANSFER_PROGRESS_INTERVAL:
+            return
+        edited = time.monotonic()
+        try:
+            await message.edit_text(template.format(*args))
+        except TelegramAPIError:
+            # the progress is not worth failing the transfer
+            pass
+
+    return report
+
+
+async def is_admin(username: str, session: AsyncSession) -> bool:
+    roles = await permission_service.get_roles(username=username, session=session)
+    return roles is not None and PermissionAdmin.permission(roles)
+
+
+@dp.message_handler(commands=['import_products'])
+async def import_products(message: types.Message, session: AsyncSession, state: FSMContext) -> None:
+    if not await is_admin(message.from_user.username, session):
+        await message.answer(PermissionDenied().message)
+        return
+    msg = await message.answer(
+        'Пришлите файл CSV или JSON с колонками name, description и image. '
+        'Изображения можно добавить в zip-архив вместе с файлом, в колонке image тогда указывается имя '
+        'изображения в архиве. Файл не больше 20 МБ'
+    )
+    await message_ledger.add(message.from_user.username, msg.message_id)
+    await state.set_state(ProductFileState.FILE)
+
+
+@dp.message_handler(state=ProductFileState.FILE, content_types=ContentType.DOCUMENT)
+async def import_products_get_file(message: types.Message, session: AsyncSession, state: FSMContext) -> None:
+    document = message.document
+    file_name = document.file_name or ''
+    is_archive = file_name.lower().endswith('.zip')
+    if not is_archive and get_file_format(file_name) is None:
+        await message.answer('Нужен файл .csv, .json или .zip')
+        return
+    if document.file_size and document.file_size > DOWNLOAD_LIMIT:
+        await message.answer('Файл больше 20 МБ, разделите его на части')
+        return
+    await state.finish()
+
+    progress_message = await message.answer('Файл загружается')
+    report_progress = progress_reporter(progress_message, 'Импортировано {}, отклонено {}')
+    with tempfile.TemporaryFile() as file:
+        await document.download(destination_file=file)
+        try:
+            archive, file_format, data_file = None, get_file_format(file_name), file
+            if is_archive:
+                archive = zipfile.ZipFile(file)
+                members = [
+                    member for member in archive.infolist()
+                    if not member.is_dir() and not member.filename.startswith('__MACOSX/')
+                    and get_file_format(member.filename) is not None
+                ]
+                if not members:
+                    await progress_message.edit_text('В архиве нет файла .csv или .json')
+                    return
+                file_format = get_file_format(members[0].filename)
+                data_file = archive.open(members[0])
+
+            report = await product_actions.import_products(
+                records=iter_products(data_file, file_format),
+                session=session,
+                username=message.from_user.username,
+                image_resolver=ImageResolver(media_store=media_store, archive=archive),
+                on_progress=report_progress
+            )
+            # the result is reported only when the products are in the catalog
+            await UnitOfWork.commit(session)
+        except PermissionDenied as error:
+            await progress_message.edit_text(error.message)
+            return
+        except (ValueError, csv.Error, zipfile.BadZipFile) as error:
+            await UnitOfWork.rollback(session)
+            await progress_message.edit_text(f'Файл не прочитан, продукты не добавлены: {error}')
+            return
+        except (asyncpg.DataError, DataError) as error:
+            # values that passed the validation and were refused by Postgres, COPY inserts all or nothing
+            await UnitOfWork.rollback(session)
+            reason = error.orig if isinstance(error, DataError) else error
+            await progress_message.edit_text(f'Импорт не удался, продукты не добавлены: {reason}')
+            return
+
+    text = f'Импорт завершён: добавлено {report.imported}, отклонено {report.rejected}'
+    if report.errors:
+        text += '\n' + '\n'.join(report.errors)
+    await progress_message.edit_text(text)
+
+
+@dp.message_handler(state=ProductFileState.FILE, content_types=ContentType.ANY)
+async def import_products_cancel(message: types.Message, state: FSMContext) -> None:
+    await state.finish()
+    msg = await message.answer('Импорт отменён, чтобы начать снова, отправьте /import_products')
+    await message_ledger.add(message.from_user.username, msg.message_id)
+
+
+@dp.message_handler(commands=['export_products'])
+async def export_products(message: types.Message, session: AsyncSession) -> None:
+    file_format = message.get_args().strip().lower() or 'csv'
+    if file_format not in ('csv', 'json'):
+        msg = await message.answer('Укажите формат, например: /export_products json')
+        await message_ledger.add(message.from_user.username, msg.message_id)
+        return
+
+    progress_message = await message.answer('Идёт выгрузка')
+    with tempfile.TemporaryFile() as file:
+        writer = ProductFileWriter(file, file_format)
+        try:
+            exported = await product_actions.export_products(
+                writer=writer,
+                session=session,
+                username=message.from_user.username,
+                on_progress=progress_reporter(progress_message, 'Выгружено {}')
+            )
+        except PermissionDenied as error:
+            await progress_message.edit_text(error.message)
+            return
+        writer.close()
+        file.seek(0)
+        try:
+            await message.answer_document(
+                types.InputFile(file, filename=f'products.{file_format}'),
+                caption=f'Выгружено продуктов: {exported}'
+            )
+        except TelegramAPIError as error:
+            await progress_message.edit_text(f'Файл не отправлен: {error}')
+            return
+    await progress_message.delete()
@@ -1,4 +1,4 @@
-import datetime
+import io
 import json
 
 from aiogram import types
@@ -6,12 +6,14 @@ from aiogram.dispatcher import FSMContext
 from aiogram.types import ContentType
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from actions.basket_actions.basket_actions import BasketActions
-from actions.user_actions.user_actions import UserActions
+import config
 from exceptions.exceptions import PermissionDenied
-from handlers.product_handler.services import ProductPages
-from keyboards.inline_keyboard import InlineKeyboard, callback_data_add_to_basket_or_delete
-from loader import dp, product_actions, redis_cache
+from handlers.product_handler.services import send_page, change_page, get_pages_data
+from keyboards.inline_keyboard import callback_data_add_to_basket_or_delete, callback_data_page, NOOP_CALLBACK_DATA
+from loader import (
+    dp, product_actions, basket_actions, redis_cache, media_registry, media_store, message_ledger, broadcaster
+)
+from middlewares.throttling_middleware import throttle
 from state.states import ProductState
 
 CACHE_KEY = ':product'
@@ -20,9 +22,7 @@ CACHE_KEY = ':product'
 @dp.message_handler(commands=['create_product'])
 async def create_product(message: types.Message, session: AsyncSession, state: FSMContext) -> None:
     msg = await message.answer('Напишите название продукта')
-    useless_messages = json.loads(await redis_cache.get(message.from_user.username + ':useless_messages'))
-    useless_messages.append(msg.message_id)
-    await redis_cache.set(message.from_user.username + ':useless_messages', json.dumps(useless_messages))
+    await message_ledger.add(message.from_user.username, msg.message_id)
     await state.set_state(ProductState.START_CREATION)
 
 
@@ -31,9 +31,7 @@ async def create_product_get_name(message: types.Message, session: AsyncSession,
     product_name = message.text
     await state.update_data(NAME=product_name)
     msg = await message.answer('Напишите описание к продукту')
-    useless_messages = json.loads(await redis_cache.get(message.from_user.username + ':useless_messages'))
-    useless_messages.extend([msg.message_id, message.message_id])
-    await redis_cache.set(message.from_user.username + ':useless_messages', json.dumps(useless_messages))
+    await message_ledger.add(message.from_user.username, msg.message_id, message.message_id)
     await state.set_state(ProductState.DESCRIPTION)
 
 
@@ -42,18 +40,16 @@ async def create_product_get_image(message: types.Message, session: AsyncSession
     product_description = message.text
     await state.update_data(DESCRIPTION=product_description)
     msg = await message.answer('Пришлите изображение продукта')
-    useless_messages = json.loads(await redis_cache.get(message.from_user.username + ':useless_messages'))
-    useless_messages.extend([msg.message_id, message.message_id])
-    await redis_cache.set(message.from_user.username + ':useless_messages', json.dumps(useless_messages))
+    await message_ledger.add(message.from_user.username, msg.message_id, message.message_id)
     await state.set_state(ProductState.IMAGE_PATH)
 
 
 @dp.message_handler(state=ProductState.IMAGE_PATH, content_types=ContentType.PHOTO)
 async def create_product_get_image(message: types.Message, session: AsyncSession, state: FSMContext) -> None:
-    photo = message.photo[1]
-    date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-    path = f'media/products_images/{date}/{date}.png'
-    await photo.download(destination_file=path)
+    photo = message.photo[-1]
+    content = await photo.download(destination_file=io.BytesIO())
+    stored_image = await media_store.save(content.getvalue())
+    path = stored_image.image_path
 
     product_state_data = await state.get_data()
     data = {
@@ -70,74 +66,90 @@ async def create_product_get_image(message: types.Message, session: AsyncSession
     except PermissionDenied as error:
         await message.answer(error.message)
     else:
-        msg1 = await message.answer('Продукт успешно создан')
+        await media_registry.register(new_product.image_path, photo.file_id)
+        msg1 = await message.answer(
+            f'Продукт успешно создан, разослать его всем пользователям: /broadcast {new_product.product_id}'
+        )
         caption = f"""
             <b>{new_product.name}</b>
             {new_product.description}
         """
-        msg2 = await message.answer_photo(
-            open(f'{new_product.image_path}', 'rb'),
+        msg2 = await media_registry.answer_photo(
+            message,
+            new_product.image_path,
             caption=caption,
             parse_mode='HTML'
         )
-        useless_messages = json.loads(await redis_cache.get(message.from_user.username + ':useless_messages'))
-        useless_messages.extend([msg1.message_id, msg2.message_id, message.message_id])
-        await redis_cache.set(message.from_user.username + ':useless_messages', json.dumps(useless_messages))
+        await message_ledger.add(message.from_user.username, msg1.message_id, msg2.message_id, message.message_id)
     await state.finish()
 
 
+@dp.message_handler(commands=['broadcast'])
+async def broadcast_product(message: types.Message, session: AsyncSession) -> None:
+    product_id = message.get_args().strip()
+    if not product_id.isdigit():
+        msg = await message.answer('Укажите номер продукта, например: /broadcast 1')
+        await message_ledger.add(message.from_user.username, msg.message_id)
+        return
+
+    try:
+        product = await product_actions.get_product_for_broadcast(
+            product_id=int(product_id),
+            session=session,
+            username=message.from_user.username
+        )
+    except PermissionDenied as error:
+        await message.answer(error.message)
+        return
+
+    if product is None:
+        text = 'Такого продукта нет'
+    elif await broadcaster.start(product=product, chat_id=message.chat.id):
+        text = f'Рассылка продукта {product["name"]} начата'
+    else:
+        text = 'Этот продукт уже рассылается'
+    msg = await message.answer(text)
+    await message_ledger.add(message.from_user.username, msg.message_id)
+
+
 @dp.callback_query_handler(callback_data_add_to_basket_or_delete.filter(action='add_product_to_basket'))
 async def add_product_to_basket(call: types.CallbackQuery, callback_data: dict, session: AsyncSession) -> None:
-    user = await UserActions.get_user_by_username(username=call.from_user.username, session=session)
-    product = await product_actions.get_product_by_id(product_id=int(callback_data['product_id']), session=session)
-    if product in user.basket.products:
+    username = call.from_user.username
+    product_id = int(callback_data['product_id'])
+    added = await basket_actions.add_product_to_user_basket(username=username, product_id=product_id, session=session)
+    if not added:
         msg = await dp.bot.send_message(chat_id=call.message.chat.id, text='Товар уже есть в корзине')
-        useless_messages = json.loads(await redis_cache.get(call.from_user.username + ':useless_messages'))
-        useless_messages.append(msg.message_id)
-        await redis_cache.set(call.from_user.username + ':useless_messages', json.dumps(useless_messages))
+        await message_ledger.add(call.from_user.username, msg.message_id)
     else:
-        new_user = await BasketActions.add_product_to_user_basket(user=user, product=product, session=session)
         msg = await dp.bot.send_message(chat_id=call.message.chat.id, text='Товар добавлен в корзину')
-        useless_messages = json.loads(await redis_cache.get(call.from_user.username + ':useless_messages'))
-        useless_messages.append(msg.message_id)
-        await redis_cache.set(call.from_user.username + ':useless_messages', json.dumps(useless_messages))
+        await message_ledger.add(call.from_user.username, msg.message_id)
 
 
 @dp.message_handler(commands=['show_products'])
 async def show_all_products(message: types.Message, session: AsyncSession) -> None:
-    all_products = await product_actions.show_products(session=session)
+    catalog_version = await product_actions.get_catalog_version()
+    products = await product_actions.show_products(session=session, version=catalog_version)
 
+    if len(products) == 0:
+        msg = await message.answer('Каталог пуст')
+        await message_ledger.add(message.from_user.username, msg.message_id)
+        return
+
+    pages = await product_actions.count_pages(session=session, version=catalog_version)
     json_data = {
         'messages': [],
-        'tab_message': None,
-        'current_page': 0,
-        'products': all_products
+        'tab_message': None
     }
 
-    for product in all_products[0]:
-        caption = f"""
-             <b>{product['name']}</b>
-             {product['description']}
-        """
-        product_message = await message.answer_photo(
-            open(f"{product['image_path']}", 'rb'),
-            caption=caption,
-            parse_mode='HTML',
-            reply_markup=await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
-                product_id=product['product_id'], delete_or_add='add'
-            )
-        )
-        json_data['messages'].append(product_message.message_id)
-
-    tab_message = await message.answer(
-        'Переключалка',
-        reply_markup=await InlineKeyboard.generate_switcher_reply_markup(
-            current_page=1,
-            pages=len(all_products),
-            callback_data=('product_left', 'product_right')
-        )
+    json_data = await send_page(
+        chat_id=message.chat.id,
+        data=json_data,
+        products=products,
+        delete_or_add='add',
+        pages=pages,
+        list_type='product',
+        version=catalog_version
     )
-    json_data['tab_message'] = tab_message.message_id
 
     await redis_cache.set(
         message.from_user.username + CACHE_KEY,
@@ -145,81 +157,48 @@ async def show_all_products(message: types.Message, session: AsyncSession) -> No
     )
 
 
-@dp.callback_query_handler(text=['product_left'])
-async def product_left(call: types.CallbackQuery) -> None:
-    current_page, pages = call.message.reply_markup.inline_keyboard[0][1].text.split('/')
-    products_previous_page = await ProductPages.get_previous_page(
-        username=call.from_user.username,
-        cache_key=CACHE_KEY,
-        delete_or_add='add'
-    )
-
-    if products_previous_page is None:
-        return
-
-    data = products_previous_page['data']
-
-    if len(products_previous_page['create']) > 0:
-        await dp.bot.delete_message(
-            chat_id=call.message.chat.id, message_id=data['tab_message']
-        )
-
-    for form in products_previous_page['post']:
-        await dp.bot.edit_message_media(chat_id=call.message.chat.id, **form)
-
-    for form in products_previous_page['create']:
-        new_message = await dp.bot.send_photo(chat_id=call.message.chat.id, **form)
-        data['messages'].append(new_message.message_id)
-
-    if len(products_previous_page['create']) > 0:
-        tab_message = await dp.bot.send_message(
-            chat_id=call.message.chat.id,
-            text='Переключалка',
-            reply_markup=await InlineKeyboard.generate_switcher_reply_markup(
-                current_page=int(current_page) - 1,
-                pages=pages,
-                callback_data=('product_left', 'product_right')
-            )
-        )
-    else:
-        tab_message = await call.message.edit_reply_markup(
-            await InlineKeyboard.generate_switcher_reply_markup(
-                current_page=int(current_page) - 1,
-                pages=pages,
-                callback_data=('product_left', 'product_right')
-            )
-        )
+@dp.callback_query_handler(text=NOOP_CALLBACK_DATA, state='*')
+@throttle(rate=None)
+async def noop(call: types.CallbackQuery) -> None:
+    await call.answer()
 
-    data['tab_message'] = tab_message.message_id
-    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data))
 
+@dp.callback_query_handler(callback_data_page.filter(list_type='product'))
+@throttle(rate=config.PAGINATION_RATE_LIMIT, debounce=config.PAGINATION_DEBOUNCE)
+async def change_products_page(call: types.CallbackQuery, callback_data: dict, session: AsyncSession) -> None:
+    """
+    Shows the page of the button, the page is taken from the current catalog version,
+    so a button made before the catalog has changed does not show outdated products.
+    A page that is not cached is found by the products of the button, so deep pages cost one query
+    """
+    data = await get_pages_data(call=call, cache_key=CACHE_KEY)
+    if data is None:
+        return
 
-@dp.callback_query_handler(text=['product_right'])
-async def product_right(call: types.CallbackQuery) -> None:
-    current_page, pages = call.message.reply_markup.inline_keyboard[0][1].text.split('/')
-    products_next_page = await ProductPages.get_next_page(
-        username=call.from_user.username,
-        cache_key=CACHE_KEY,
-        delete_or_add='add'
+    page = int(callback_data['page'])
+    after_id, before_id, version = callback_data['after_id'], callback_data['before_id'], callback_data['version']
+    catalog_version = await product_actions.get_catalog_version()
+    products = await product_actions.show_products(
+        session=session,
+        page=page,
+        version=catalog_version,
+        after_id=int(after_id) if after_id else None,
+        before_id=int(before_id) if before_id else None,
+        cursor_version=int(version) if version else None
     )
-
-    if products_next_page is None:
+    if len(products) == 0:
+        await call.answer('Это последняя страница')
         return
 
-    for form in products_next_page['post']:
-        await dp.bot.edit_message_media(chat_id=call.message.chat.id, **form)
-
-    for message in products_next_page['delete']:
-        await dp.bot.delete_message(chat_id=call.message.chat.id, message_id=message)
-
-    tab_message = await call.message.edit_reply_markup(
-        await InlineKeyboard.generate_switcher_reply_markup(
-            current_page=int(current_page) + 1,
-            pages=pages,
-            callback_data=('product_left', 'product_right')
-        )
+    pages = await product_actions.count_pages(session=session, version=catalog_version)
+    data = await change_page(
+        call=call,
+        data=data,
+        products=products,
+        delete_or_add='add',
+        page=page,
+        pages=pages,
+        list_type='product',
+        version=catalog_version
     )
-
-    data = products_next_page['data']
-    data['tab_message'] = tab_message.message_id
-    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data))
+    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data, default=str))
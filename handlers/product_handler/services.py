@@ -1,12 +1,17 @@
+import asyncio
 import json
+import logging
 from itertools import zip_longest
-from typing import Optional
+from typing import Awaitable, Optional
 
-from aiogram.types import InputMediaPhoto
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.exceptions import TelegramAPIError
 
-from database.models import Product
+import config
 from keyboards.inline_keyboard import InlineKeyboard
-from loader import redis_cache
+from loader import dp, media_registry, message_cleaner, redis_cache, render_cache
+from services.render_cache import RenderedProduct
 
 
 class ProductPages:
@@ -16,107 +21,296 @@ class ProductPages:
         return [item for item in data['messages'] if item not in messages_for_delete]
 
     @classmethod
-    async def _form_post_data(cls, product: Product, request_forms: dict, reply_markup=None, message: int = None,
-                              type_post: str = 'post') -> dict:
-        caption = f"""
-             <b>{product['name']}</b>
-             {product['description']}
-        """
-
+    async def _form_post_data(cls, product: dict, rendered: RenderedProduct, request_forms: dict,
+                              message: int = None, type_post: str = 'post') -> dict:
+        post_data = {
+            'image_path': product['image_path'],
+            'caption': rendered.caption,
+            'parse_mode': rendered.parse_mode,
+            'reply_markup': rendered.reply_markup
+        }
         if type_post == 'post':
-            post_data = {
-                'media': InputMediaPhoto(
-                    open(product['image_path'], 'rb'),
-                    caption=caption,
-                    parse_mode='HTML',
-                ),
-                'message_id': message,
-                'reply_markup': reply_markup
-            }
-        else:
-            post_data = {
-                'photo': open(f"{product['image_path']}", 'rb'),
-                'caption': caption,
-                'parse_mode': 'HTML',
-                'reply_markup': reply_markup
-            }
+            post_data['message_id'] = message
 
         request_forms[f'{type_post}'].append(post_data)
         return request_forms
 
     @classmethod
-    async def get_next_page(cls, username: str, cache_key: str, delete_or_add: str) -> Optional[dict]:
-        data = json.loads(await redis_cache.get(username + cache_key))
-        products = data['products']
-
-        if not (data['current_page'] < len(products) - 1):
-            return None
-
-        data['current_page'] += 1
+    async def form_page(cls, data: dict, products: list[dict], delete_or_add: str, version: int = None) -> dict:
+        """
+        Forms requests that turn the messages of the current page into the given page products:
+        existing messages are edited, missing ones are created and extra ones are deleted
+        :param data: dict - user's pages data with messages of the current page
+        :param products: list[dict] - products of the new page
+        :param delete_or_add: str
+        :param version: int - catalog version of the products, their renders are cached by it
+        :return: dict
+        """
         request_forms = {
             'post': [],
+            'create': [],
             'delete': []
         }
 
-        for message, product in zip_longest(
-                data['messages'],
-                products[data['current_page']],
-                fillvalue=None
-        ):
-            if product is not None:
+        for message, product in zip_longest(data['messages'], products, fillvalue=None):
+            if product is None:
+                request_forms['delete'].append(message)
+                continue
+
+            rendered = await render_cache.render(product=product, delete_or_add=delete_or_add, version=version)
+            if message is not None:
                 request_forms = await cls._form_post_data(
                     product=product,
+                    rendered=rendered,
                     request_forms=request_forms,
-                    message=message,
-                    reply_markup=await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
-                        product_id=product['product_id'], delete_or_add=delete_or_add)
+                    message=message
                 )
             else:
-                request_forms['delete'].append(message)
+                request_forms = await cls._form_post_data(
+                    product=product,
+                    rendered=rendered,
+                    request_forms=request_forms,
+                    type_post='create'
+                )
 
         data['messages'] = await cls._clear_useless_messages(
             request_forms=request_forms,
             data=data
         )
         request_forms['data'] = data
-
         return request_forms
 
     @classmethod
-    async def get_previous_page(cls, username: str, cache_key: str, delete_or_add: str) -> Optional[dict]:
-        data = json.loads(await redis_cache.get(username + cache_key))
-        products = data['products']
+    async def _gather_requests(cls, requests: list[tuple[Optional[int], Awaitable]]) -> dict:
+        """
+        Runs Telegram requests concurrently, but not more than config.PAGE_REQUESTS_CONCURRENCY at once
+        :param requests: list of (message_id, request)
+        :return: dict - {message_id: error} of failed requests
+        """
+        semaphore = asyncio.Semaphore(config.PAGE_REQUESTS_CONCURRENCY)
+        failures = {}
 
-        if not (data['current_page'] > 0):
-            return None
+        async def run(message_id: Optional[int], request: Awaitable) -> None:
+            async with semaphore:
+                try:
+                    await request
+                except TelegramAPIError as error:
+                    failures[message_id] = error
 
-        data['current_page'] -= 1
-        request_forms = {
-            'post': [],
-            'create': []
-        }
+        await asyncio.gather(*(run(message_id, request) for message_id, request in requests))
+        for message_id, error in failures.items():
+            logging.warning(f'PAGE REQUEST FOR MESSAGE {message_id} FAILED: {error}')
+        return failures
 
-        for message, product in zip_longest(
-                data['messages'],
-                products[data['current_page']],
-                fillvalue=None
-        ):
-            if message is not None:
-                request_forms = await cls._form_post_data(
-                    product=product,
-                    request_forms=request_forms,
-                    message=message,
-                    reply_markup=await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
-                        product_id=product['product_id'], delete_or_add=delete_or_add)
-                )
-            else:
-                request_forms = await cls._form_post_data(
-                    product=product,
-                    request_forms=request_forms,
-                    type_post='create',
-                    reply_markup=await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
-                        product_id=product['product_id'], delete_or_add=delete_or_add)
-                )
+    @classmethod
+    async def _create_messages(cls, chat_id: int, forms: list[dict], data: dict) -> None:
+        # new messages are sent one by one, so they keep the order of products
+        for form in forms:
+            new_message = await media_registry.send_photo(chat_id=chat_id, **form)
+            data['messages'].append(new_message.message_id)
 
-        request_forms['data'] = data
-        return request_forms
+    @classmethod
+    async def show_page(cls, call: types.CallbackQuery, request_forms: dict,
+                        reply_markup: InlineKeyboardMarkup) -> dict:
+        """
+        Sends the requests formed by form_page concurrently, the tab message is sent
+        after the new messages, so it stays under the page
+        :param call: CallbackQuery
+        :param request_forms: dict
+        :param reply_markup: InlineKeyboardMarkup - switcher of the new page
+        :return: dict - user's pages data with new message ids
+        """
+        chat_id = call.message.chat.id
+        data = request_forms['data']
+        creates_messages = len(request_forms['create']) > 0
+
+        requests = []
+        if creates_messages:
+            requests.append((
+                data['tab_message'], dp.bot.delete_message(chat_id=chat_id, message_id=data['tab_message'])
+            ))
+        for form in request_forms['post']:
+            requests.append((form['message_id'], media_registry.edit_message_media(chat_id=chat_id, **form)))
+        for message in request_forms['delete']:
+            requests.append((message, dp.bot.delete_message(chat_id=chat_id, message_id=message)))
+        if creates_messages:
+            requests.append((
+                None, cls._create_messages(chat_id=chat_id, forms=request_forms['create'], data=data)
+            ))
+        await cls._gather_requests(requests)
+
+        if creates_messages:
+            tab_message = await dp.bot.send_message(chat_id=chat_id, text='Переключалка', reply_markup=reply_markup)
+        else:
+            tab_message = await call.message.edit_reply_markup(reply_markup)
+
+        data['tab_message'] = tab_message.message_id
+        return data
+
+
+class AlbumPages(ProductPages):
+    """
+    Renders a page as one album and the tab message under it with the switcher and
+    numbered buttons of the products, so a new page costs two requests whatever its size
+    """
+    @classmethod
+    async def _form_album(cls, products: list[dict], version: int = None) -> list[dict]:
+        album = await render_cache.render_album(products, version=version)
+        return [
+            {'image_path': product['image_path'], 'caption': rendered.caption, 'parse_mode': rendered.parse_mode}
+            for product, rendered in zip(products, album)
+        ]
+
+    @classmethod
+    async def send_page(cls, chat_id: int, data: dict, products: list[dict],
+                        reply_markup: InlineKeyboardMarkup, version: int = None) -> dict:
+        """
+        :param chat_id: int
+        :param data: dict - user's pages data
+        :param products: list[dict] - products of the page
+        :param reply_markup: InlineKeyboardMarkup - album keyboard of the page
+        :param version: int - catalog version of the products, their captions are cached by it
+        :return: dict - user's pages data with new message ids
+        """
+        forms = await cls._form_album(products, version=version)
+        # a media group holds from 2 to 10 photos
+        if len(forms) == 1:
+            messages = [await media_registry.send_photo(chat_id=chat_id, **forms[0])]
+        else:
+            messages = await media_registry.send_media_group(chat_id=chat_id, forms=forms)
+        tab_message = await dp.bot.send_message(chat_id=chat_id, text='Переключалка', reply_markup=reply_markup)
+
+        data['messages'] = [message.message_id for message in messages]
+        data['tab_message'] = tab_message.message_id
+        return data
+
+    @classmethod
+    async def show_page(cls, call: types.CallbackQuery, data: dict, products: list[dict],
+                        reply_markup: InlineKeyboardMarkup, version: int = None) -> dict:
+        """
+        Edits the photos of the album and the tab message in place, the album is sent
+        again only if the new page has more products, as photos can not be added into a sent album
+        :param call: CallbackQuery
+        :param data: dict - user's pages data with messages of the current page
+        :param products: list[dict] - products of the new page
+        :param reply_markup: InlineKeyboardMarkup - album keyboard of the new page
+        :param version: int - catalog version of the products, their captions are cached by it
+        :return: dict - user's pages data with new message ids
+        """
+        chat_id = call.message.chat.id
+        if len(products) > len(data['messages']):
+            message_cleaner.schedule(chat_id, [*data['messages'], data['tab_message']])
+            return await cls.send_page(
+                chat_id=chat_id, data=data, products=products, reply_markup=reply_markup, version=version
+            )
+
+        forms = await cls._form_album(products, version=version)
+        requests = [
+            (message_id, media_registry.edit_message_media(chat_id=chat_id, message_id=message_id, **form))
+            for message_id, form in zip(data['messages'], forms)
+        ]
+        requests.append((data['tab_message'], call.message.edit_reply_markup(reply_markup)))
+        await cls._gather_requests(requests)
+
+        message_cleaner.schedule(chat_id, data['messages'][len(forms):])
+        data['messages'] = data['messages'][:len(forms)]
+        return data
+
+
+async def get_pages_data(call: types.CallbackQuery, cache_key: str) -> Optional[dict]:
+    """
+    Loads the user's pages data for a switcher button, the buttons of a page that is not
+    the user's current one are stale and only answered
+    :param call: CallbackQuery
+    :param cache_key: str - key suffix of the list
+    :return: dict - user's pages data, None if the keyboard is stale
+    """
+    data = await redis_cache.get(call.from_user.username + cache_key)
+    # the pages data is dropped together with its messages on the next command
+    data = None if data is None else json.loads(data)
+    if data is None or data['tab_message'] != call.message.message_id:
+        await call.answer('Эта страница устарела')
+        return None
+    return data
+
+
+async def send_page(chat_id: int, data: dict, products: list[dict], delete_or_add: str, pages: int,
+                    list_type: str, version: int = None) -> dict:
+    """
+    Sends the first page in the configured PAGE_RENDER_MODE
+    :param chat_id: int
+    :param data: dict - user's pages data without messages
+    :param products: list[dict] - products of the page
+    :param delete_or_add: str
+    :param pages: int
+    :param list_type: str - product, basket or search
+    :param version: int - catalog version of the page
+    :return: dict - user's pages data with message ids
+    """
+    switcher = {
+        'current_page': 1,
+        'pages': pages,
+        'list_type': list_type,
+        'version': version,
+        'first_id': products[0]['product_id'],
+        'last_id': products[-1]['product_id']
+    }
+    if config.PAGE_RENDER_MODE == 'album':
+        reply_markup = await InlineKeyboard.generate_album_reply_markup(
+            products=products, delete_or_add=delete_or_add, **switcher
+        )
+        return await AlbumPages.send_page(
+            chat_id=chat_id, data=data, products=products, reply_markup=reply_markup, version=version
+        )
+
+    request_forms = await ProductPages.form_page(
+        data=data, products=products, delete_or_add=delete_or_add, version=version
+    )
+    await ProductPages._create_messages(chat_id=chat_id, forms=request_forms['create'], data=data)
+    tab_message = await dp.bot.send_message(
+        chat_id=chat_id,
+        text='Переключалка',
+        reply_markup=await InlineKeyboard.generate_switcher_reply_markup(**switcher)
+    )
+    data['tab_message'] = tab_message.message_id
+    return data
+
+
+async def change_page(call: types.CallbackQuery, data: dict, products: list[dict], delete_or_add: str, page: int,
+                      pages: int, list_type: str, version: int = None) -> dict:
+    """
+    Shows the given products instead of the current page in the configured PAGE_RENDER_MODE
+    :param call: CallbackQuery
+    :param data: dict - user's pages data
+    :param products: list[dict] - products of the new page
+    :param delete_or_add: str
+    :param page: int - index of the new page
+    :param pages: int
+    :param list_type: str - product, basket or search
+    :param version: int - catalog version of the new page
+    :return: dict - user's pages data with new message ids
+    """
+    # the count of pages can be estimated or changed meanwhile, so the current page is never shown greater than it
+    current_page = page + 1
+    switcher = {
+        'current_page': current_page,
+        'pages': max(pages, current_page),
+        'list_type': list_type,
+        'version': version,
+        'first_id': products[0]['product_id'],
+        'last_id': products[-1]['product_id']
+    }
+
+    if config.PAGE_RENDER_MODE == 'album':
+        reply_markup = await InlineKeyboard.generate_album_reply_markup(
+            products=products, delete_or_add=delete_or_add, **switcher
+        )
+        return await AlbumPages.show_page(
+            call=call, data=data, products=products, reply_markup=reply_markup, version=version
+        )
+
+    request_forms = await ProductPages.form_page(
+        data=data, products=products, delete_or_add=delete_or_add, version=version
+    )
+    reply_markup = await InlineKeyboard.generate_switcher_reply_markup(**switcher)
+    return await ProductPages.show_page(call=call, request_forms=request_forms, reply_markup=reply_markup)
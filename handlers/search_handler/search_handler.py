@@ -0,0 +1,82 @@
+import json
+
+from aiogram import types
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from handlers.product_handler.services import send_page, change_page, get_pages_data
+from keyboards.inline_keyboard import callback_data_page
+from loader import dp, product_actions, redis_cache, message_ledger
+from middlewares.throttling_middleware import throttle
+
+CACHE_KEY = ':search'
+
+
+@dp.message_handler(commands=['search'])
+async def search_products(message: types.Message, session: AsyncSession) -> None:
+    query = message.get_args()
+    if not query or not query.strip():
+        msg = await message.answer('Напишите, что найти, например: /search чай')
+        await message_ledger.add(message.from_user.username, msg.message_id)
+        return
+
+    catalog_version = await product_actions.get_catalog_version()
+    products, pages = await product_actions.search_products(query=query, session=session, version=catalog_version)
+
+    if len(products) == 0:
+        msg = await message.answer('Ничего не найдено')
+        await message_ledger.add(message.from_user.username, msg.message_id)
+        return
+
+    json_data = {
+        'messages': [],
+        'tab_message': None,
+        # the query does not fit into the callback data of the switcher
+        'query': query
+    }
+    json_data = await send_page(
+        chat_id=message.chat.id,
+        data=json_data,
+        products=products,
+        delete_or_add='add',
+        pages=pages,
+        list_type='search',
+        version=catalog_version
+    )
+
+    await redis_cache.set(
+        message.from_user.username + CACHE_KEY,
+        json.dumps(json_data, default=str)
+    )
+
+
+@dp.callback_query_handler(callback_data_page.filter(list_type='search'))
+@throttle(rate=config.PAGINATION_RATE_LIMIT, debounce=config.PAGINATION_DEBOUNCE)
+async def change_search_page(call: types.CallbackQuery, callback_data: dict, session: AsyncSession) -> None:
+    """
+    Shows the page of the button, the results are taken for the current catalog version
+    """
+    data = await get_pages_data(call=call, cache_key=CACHE_KEY)
+    if data is None:
+        return
+
+    page = int(callback_data['page'])
+    catalog_version = await product_actions.get_catalog_version()
+    products, pages = await product_actions.search_products(
+        query=data['query'], session=session, page=page, version=catalog_version
+    )
+    if len(products) == 0:
+        await call.answer('Это последняя страница')
+        return
+
+    data = await change_page(
+        call=call,
+        data=data,
+        products=products,
+        delete_or_add='add',
+        page=page,
+        pages=pages,
+        list_type='search',
+        version=catalog_version
+    )
+    await redis_cache.set(call.from_user.username + CACHE_KEY, json.dumps(data, default=str))
@@ -17,6 +17,9 @@ async def start_command(message: types.Message, session: AsyncSession) -> None:
             reply_markup=await InlineKeyboard.generate_reply_keyboard_markup()
         )
     else:
+        # users added before chats were stored get their chat on the next /start
+        if user.chat_id != message.chat.id:
+            await UserActions.set_chat_id(username=user.username, chat_id=message.chat.id, session=session)
         if user.is_admin:
             msg = await message.answer(
                 'Вам доступны новые функции',
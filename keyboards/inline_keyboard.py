@@ -2,24 +2,48 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeybo
 from aiogram.utils.callback_data import CallbackData
 
 callback_data_add_to_basket_or_delete = CallbackData('product_to_basket', 'action', 'product_id')
+callback_data_page = CallbackData('page', 'list_type', 'page', 'version', 'after_id', 'before_id')
+# buttons that do nothing, their callbacks are only answered
+NOOP_CALLBACK_DATA = 'noop'
 
 
 class InlineKeyboard:
     @staticmethod
-    async def generate_switcher_reply_markup(current_page: int, pages: int,
-                                             callback_data: tuple[str, str]) -> InlineKeyboardMarkup:
+    async def generate_switcher_reply_markup(current_page: int, pages: int, list_type: str, version: int = None,
+                                             first_id: int = None, last_id: int = None) -> InlineKeyboardMarkup:
+        """
+        The buttons carry everything needed to show their page, so a flip does not read the state of the page
+        :param current_page: int - shown page, starting from 1
+        :param pages: int
+        :param list_type: str - product, basket or search
+        :param version: int - catalog version of the page
+        :param first_id: int - first product of the page, for keyset lists
+        :param last_id: int - last product of the page, for keyset lists
+        """
         markup = InlineKeyboardMarkup()
+        version = '' if version is None else version
+        if current_page > 1:
+            left_callback_data = callback_data_page.new(
+                list_type=list_type, page=current_page - 2, version=version,
+                after_id='', before_id='' if first_id is None else first_id
+            )
+        else:
+            left_callback_data = NOOP_CALLBACK_DATA
         ib1 = InlineKeyboardButton(
             text='<',
-            callback_data=f'{callback_data[0]}'
+            callback_data=left_callback_data
         )
         ib2 = InlineKeyboardButton(
             text=f'{current_page}/{pages}',
-            callback_data='1/1'
+            callback_data=NOOP_CALLBACK_DATA
         )
+        # the count of pages can be estimated, so the right button is never disabled
         ib3 = InlineKeyboardButton(
             text='>',
-            callback_data=f'{callback_data[1]}'
+            callback_data=callback_data_page.new(
+                list_type=list_type, page=current_page, version=version,
+                after_id='' if last_id is None else last_id, before_id=''
+            )
         )
         markup.add(ib1, ib2, ib3)
         return markup
@@ -45,6 +69,38 @@ class InlineKeyboard:
         markup.add(ib1)
         return markup
 
+    @staticmethod
+    async def generate_album_reply_markup(products: list[dict], delete_or_add: str, current_page: int, pages: int,
+                                          list_type: str, version: int = None, first_id: int = None,
+                                          last_id: int = None) -> InlineKeyboardMarkup:
+        """
+        Switcher of the album page with numbered add or delete buttons of its products under it
+        """
+        markup = await InlineKeyboard.generate_switcher_reply_markup(
+            current_page=current_page,
+            pages=pages,
+            list_type=list_type,
+            version=version,
+            first_id=first_id,
+            last_id=last_id
+        )
+        if delete_or_add == 'add':
+            text, action = '🛒', 'add_product_to_basket'
+        else:
+            text, action = '❌', 'remove_product_from_basket'
+
+        markup.row_width = 5
+        markup.add(*(
+            InlineKeyboardButton(
+                text=f'{number} {text}',
+                callback_data=callback_data_add_to_basket_or_delete.new(
+                    action=action, product_id=product['product_id']
+                )
+            )
+            for number, product in enumerate(products, start=1)
+        ))
+        return markup
+
     @staticmethod
     async def generate_reply_keyboard_markup(user_is_admin: bool = False) -> ReplyKeyboardMarkup:
         markup = ReplyKeyboardMarkup()
@@ -1,10 +1,11 @@
-import json
+import sys
 
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from loader import redis_cache, dp
+from database.unit_of_work import UnitOfWork
+from loader import message_ledger, message_cleaner
 
 
 class DbMiddleware(BaseMiddleware):
@@ -12,63 +13,35 @@ class DbMiddleware(BaseMiddleware):
         super().__init__()
         self.session_pool = session_pool
 
-    async def get_all_useless_messages(self, msg: Message) -> list:
-        useless_messages = await redis_cache.get(msg.from_user.username + ':useless_messages')
-        if useless_messages is not None:
-            await redis_cache.set(msg.from_user.username + ':useless_messages', json.dumps([]))
-            return json.loads(useless_messages)
-        return []
+    async def on_process_message(self, msg: Message, data: dict) -> None:
+        # the message itself is deleted on the next command, if it is not a part of a dialog
+        new_useless_messages = [msg.message_id] if data['raw_state'] is None else []
 
-    async def get_all_useless_basket_messages(self, msg: Message) -> list:
-        basket_data = await redis_cache.get(msg.from_user.username + ':basket')
-        if basket_data is not None:
-            basket_data = json.loads(basket_data)
-            messages = basket_data['messages'].copy()
-            messages.append(basket_data['tab_message'])
-            basket_data['messages'].clear()
-            basket_data['tab_message'] = None
-            await redis_cache.set(msg.from_user.username + ':basket', json.dumps(basket_data))
-            return messages
-        return []
+        if msg.text is not None and msg.text[0] == '/':
+            useless_messages = await message_ledger.drain(msg.from_user.username, *new_useless_messages)
+            message_cleaner.schedule(chat_id=msg.chat.id, message_ids=useless_messages)
+        elif new_useless_messages:
+            await message_ledger.add(msg.from_user.username, *new_useless_messages)
 
-    async def get_all_useless_product_messages(self, msg: Message) -> list:
-        product_data = await redis_cache.get(msg.from_user.username + ':product')
-        if product_data is not None:
-            product_data = json.loads(product_data)
-            messages = product_data['messages'].copy()
-            messages.append(product_data['tab_message'])
-            product_data['messages'].clear()
-            product_data['tab_message'] = None
-            await redis_cache.set(msg.from_user.username + ':product', json.dumps(product_data))
-            return messages
-        return []
+        self.open_session(data)
 
-    async def delete_useless_messages(self, msg: Message) -> None:
-        useless_messages = await self.get_all_useless_messages(msg)
-        useless_messages_basket = await self.get_all_useless_basket_messages(msg)
-        useless_messages_product = await self.get_all_useless_product_messages(msg)
-        useless_messages = [
-            *useless_messages,
-            *useless_messages_basket,
-            *useless_messages_product
-        ]
+    async def on_process_callback_query(self, call: CallbackQuery, data: dict) -> None:
+        self.open_session(data)
 
-        for message in useless_messages:
-            if message is not None:
-                await dp.bot.delete_message(chat_id=msg.chat.id, message_id=message)
+    async def on_post_process_message(self, msg: Message, results: list, data: dict) -> None:
+        await self.close_session(data)
 
-    async def on_process_message(self, msg: Message, data: dict) -> None:
-        if msg.text is not None:
-            if msg.text[0] == '/':
-                await self.delete_useless_messages(msg)
+    async def on_post_process_callback_query(self, call: CallbackQuery, results: list, data: dict) -> None:
+        await self.close_session(data)
 
-        if data['raw_state'] is None:
-            await redis_cache.set(msg.from_user.username + ':useless_messages', json.dumps([msg.message_id]))
+    def open_session(self, data: dict) -> None:
+        # the session is lazy, a connection is taken from the pool only on the first query
+        if 'session' not in data:
+            data['session'] = self.session_pool()
 
-        async with self.session_pool() as session:
-            data['session'] = session
-
-    async def on_process_callback_query(self, call: CallbackQuery, data: dict) -> None:
-        if data.get('callback_data') is not None:
-            async with self.session_pool() as session:
-                data['session'] = session
+    @staticmethod
+    async def close_session(data: dict) -> None:
+        session = data.pop('session', None)
+        if session is not None:
+            # post process hooks are triggered in finally, so the handler's exception is still being handled here
+            await UnitOfWork.complete(session, error=sys.exc_info()[1])
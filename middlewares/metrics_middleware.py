@@ -0,0 +1,50 @@
+import sys
+import time
+
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, InlineQuery
+
+from services.metrics import HANDLER_DURATION, HANDLER_ERRORS
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Times handlers by their names. It is set up after DbMiddleware,
+    so the time includes the commit of the handler's session
+    """
+
+    async def on_process_message(self, msg: Message, data: dict) -> None:
+        self.start(data)
+
+    async def on_process_callback_query(self, call: CallbackQuery, data: dict) -> None:
+        self.start(data)
+
+    async def on_process_inline_query(self, inline_query: InlineQuery, data: dict) -> None:
+        self.start(data)
+
+    async def on_post_process_message(self, msg: Message, results: list, data: dict) -> None:
+        self.observe(data)
+
+    async def on_post_process_callback_query(self, call: CallbackQuery, results: list, data: dict) -> None:
+        self.observe(data)
+
+    async def on_post_process_inline_query(self, inline_query: InlineQuery, results: list, data: dict) -> None:
+        self.observe(data)
+
+    @staticmethod
+    def start(data: dict) -> None:
+        data['metrics_handler'] = current_handler.get().__name__
+        data['metrics_started'] = time.perf_counter()
+
+    @staticmethod
+    def observe(data: dict) -> None:
+        handler = data.pop('metrics_handler', None)
+        started = data.pop('metrics_started', None)
+        # updates without a matching handler are not processed
+        if handler is None:
+            return
+        HANDLER_DURATION.labels(handler=handler).observe(time.perf_counter() - started)
+        # the exception raised by the handler, if any, is the one being handled while the hook runs
+        if sys.exc_info()[1] is not None:
+            HANDLER_ERRORS.labels(handler=handler).inc()
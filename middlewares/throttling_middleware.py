@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple, Optional
+
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.types import CallbackQuery
+from aiogram.utils.exceptions import TelegramAPIError
+
+import config
+from services.metrics import CALLBACKS_COALESCED, CALLBACKS_THROTTLED
+
+
+class ThrottlingRule(NamedTuple):
+    # handled callbacks per second of a user, None for no limit
+    rate: Optional[float]
+    # clicks that come within this time one after another are handled as the last of them
+    debounce: float = 0
+    # handlers with the same key are throttled together
+    key: Optional[str] = None
+
+
+def throttle(rate: Optional[float] = None, debounce: float = 0, key: Optional[str] = None) -> Callable:
+    """
+    Sets the throttling rule of a callback query handler, it has to be applied under the handler registration
+    :param rate: float - handled callbacks per second of a user, None for no limit
+    :param debounce: float - seconds to wait for the next click before the handler is run
+    :param key: str - handlers with the same key are throttled together, the handler name by default
+    """
+    def decorator(handler: Callable) -> Callable:
+        handler.throttling_rule = ThrottlingRule(rate=rate, debounce=debounce, key=key)
+        return handler
+    return decorator
+
+
+class _ClickState:
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.latest = None
+        self.handled_at = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Rate limits callback queries of a user per handler. Clicks of handlers with debounce are coalesced:
+    every click waits for the next one, only the last click is handled and the handlers of one user
+    run one after another, so hammering a page switcher costs one render of the page the user stops at.
+    Dropped callbacks are answered at once, so the client does not show them loading
+    """
+
+    def __init__(self, rate: Optional[float] = config.CALLBACK_RATE_LIMIT,
+                 size: int = config.THROTTLING_STATE_SIZE) -> None:
+        super().__init__()
+        self.default_rule = ThrottlingRule(rate=rate)
+        self.size = size
+        self._states = OrderedDict()
+
+    def _get_state(self, key: tuple) -> _ClickState:
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _ClickState()
+            if len(self._states) > self.size:
+                self._states.popitem(last=False)
+        self._states.move_to_end(key)
+        return state
+
+    async def on_process_callback_query(self, call: CallbackQuery, data: dict) -> None:
+        handler = current_handler.get()
+        rule = getattr(handler, 'throttling_rule', self.default_rule)
+        if rule.rate is None and not rule.debounce:
+            return
+        handler_name = handler.__name__
+        state = self._get_state((call.from_user.id, rule.key or handler_name))
+        interval = 1 / rule.rate if rule.rate else 0
+
+        if not rule.debounce:
+            if time.monotonic() - state.handled_at < interval:
+                CALLBACKS_THROTTLED.labels(handler=handler_name).inc()
+                await call.answer('Слишком часто, подождите немного')
+                raise CancelHandler()
+            state.handled_at = time.monotonic()
+            return
+
+        superseded, state.latest = state.latest, call
+        if superseded is not None:
+            await self._drop_coalesced(superseded, handler_name)
+        await asyncio.sleep(rule.debounce)
+        await state.lock.acquire()
+        # a newer click has come while this one waited, it is answered by that click
+        if state.latest is not call:
+            state.lock.release()
+            raise CancelHandler()
+        # instead of dropping the last click, the rate is kept by waiting
+        delay = state.handled_at + interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            if state.latest is not call:
+                state.lock.release()
+                raise CancelHandler()
+        state.latest = None
+        data['throttling_state'] = state
+
+    @staticmethod
+    async def _drop_coalesced(call: CallbackQuery, handler_name: str) -> None:
+        CALLBACKS_COALESCED.labels(handler=handler_name).inc()
+        try:
+            await call.answer()
+        except TelegramAPIError as error:
+            # the newer click must be handled even if the old callback can not be answered anymore
+            logging.warning(f'COALESCED CALLBACK {call.id} IS NOT ANSWERED: {error}')
+
+    async def on_post_process_callback_query(self, call: CallbackQuery, results: list, data: dict) -> None:
+        state = data.pop('throttling_state', None)
+        if state is not None:
+            state.handled_at = time.monotonic()
+            state.lock.release()
@@ -0,0 +1,96 @@
+"""hot lookup indexes
+
+Revision ID: a3c9d27e41b8
+Revises: 56f8e106faaa
+Create Date: 2026-10-18 19:02:11.514260
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9d27e41b8'
+down_revision = '56f8e106faaa'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_User_username', 'User', ['username'], False),
+    ('ix_Basket_user_id', 'Basket', ['user_id'], True),
+    ('association_table_pkey', 'association_table', ['basket_id', 'product_id'], True),
+    ('ix_association_table_product_id', 'association_table', ['product_id'], False),
+)
+
+
+def get_indexes() -> dict[str, bool]:
+    """
+    :return: dict[str, bool] - validity of the indexes of the migration that exist already
+    """
+    result = op.get_bind().execute(
+        sa.text(
+            'SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+            'WHERE c.relname = ANY(:names)'
+        ),
+        {'names': [name for name, *_ in INDEXES]}
+    )
+    return dict(result.all())
+
+
+def upgrade() -> None:
+    # baskets duplicated by concurrent /start of one user would break the unique index,
+    # the products of the extra baskets are moved to the first basket of the user
+    op.execute(
+        'UPDATE association_table a SET basket_id = b.kept_id FROM ('
+        'SELECT basket_id, min(basket_id) OVER (PARTITION BY user_id) AS kept_id '
+        'FROM "Basket" WHERE user_id IS NOT NULL'
+        ') b WHERE a.basket_id = b.basket_id AND b.basket_id <> b.kept_id'
+    )
+    op.execute(
+        'DELETE FROM "Basket" a USING "Basket" b '
+        'WHERE a.user_id = b.user_id AND a.basket_id > b.basket_id'
+    )
+    # rows without a key or duplicated rows would break the primary key of association_table
+    op.execute('DELETE FROM association_table WHERE basket_id IS NULL OR product_id IS NULL')
+    op.execute(
+        'DELETE FROM association_table a USING association_table b '
+        'WHERE a.ctid < b.ctid AND a.basket_id = b.basket_id AND a.product_id = b.product_id'
+    )
+    # SET NOT NULL skips the full table scan when a validated check constraint proves it,
+    # the constraint is left behind by a run that failed in the autocommit block
+    op.execute('ALTER TABLE association_table DROP CONSTRAINT IF EXISTS association_table_keys_not_null')
+    op.execute(
+        'ALTER TABLE association_table ADD CONSTRAINT association_table_keys_not_null '
+        'CHECK (basket_id IS NOT NULL AND product_id IS NOT NULL) NOT VALID'
+    )
+
+    # indexes are built concurrently, so the tables stay writable during the migration
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE association_table VALIDATE CONSTRAINT association_table_keys_not_null')
+        # a failed concurrent build leaves an invalid index behind, which is dropped and built again
+        existing_indexes = get_indexes()
+        for name, table, columns, unique in INDEXES:
+            if existing_indexes.get(name) is False:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+            if not existing_indexes.get(name):
+                op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+    op.alter_column('association_table', 'basket_id', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('association_table', 'product_id', existing_type=sa.Integer(), nullable=False)
+    op.execute(
+        'ALTER TABLE association_table ADD CONSTRAINT association_table_pkey '
+        'PRIMARY KEY USING INDEX association_table_pkey'
+    )
+    op.drop_constraint('association_table_keys_not_null', 'association_table', type_='check')
+
+
+def downgrade() -> None:
+    op.drop_constraint('association_table_pkey', 'association_table', type_='primary')
+    op.alter_column('association_table', 'product_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('association_table', 'basket_id', existing_type=sa.Integer(), nullable=True)
+
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_association_table_product_id', table_name='association_table', postgresql_concurrently=True)
+        op.drop_index('ix_Basket_user_id', table_name='Basket', postgresql_concurrently=True)
+        op.drop_index('ix_User_username', table_name='User', postgresql_concurrently=True)
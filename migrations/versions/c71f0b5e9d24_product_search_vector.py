@@ -0,0 +1,80 @@
+"""product search vector
+
+Revision ID: c71f0b5e9d24
+Revises: a3c9d27e41b8
+Create Date: 2026-10-18 21:14:37.208114
+
+"""
+from alembic import op, context
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71f0b5e9d24'
+down_revision = 'a3c9d27e41b8'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 5000
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('russian', coalesce({row}.name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce({row}.description, '')), 'B')
+"""
+
+
+def upgrade() -> None:
+    # a generated column would rewrite the whole table under an exclusive lock,
+    # so the column is filled by a trigger and the existing rows are backfilled in batches
+    op.add_column('Product', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION product_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR.format(row='NEW')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER product_search_vector_update BEFORE INSERT OR UPDATE OF name, description ON "Product"
+        FOR EACH ROW EXECUTE FUNCTION product_search_vector_update()
+    """)
+
+    product_search_vector = SEARCH_VECTOR.format(row='"Product"')
+    backfill = sa.text(f"""
+        UPDATE "Product" SET search_vector = {product_search_vector}
+        WHERE product_id IN (
+            SELECT product_id FROM "Product"
+            WHERE product_id > :after_id AND search_vector IS NULL
+            ORDER BY product_id LIMIT :batch_size
+        )
+        RETURNING product_id
+    """)
+    with op.get_context().autocommit_block():
+        if context.is_offline_mode():
+            op.execute(f'UPDATE "Product" SET search_vector = {product_search_vector}')
+        else:
+            # every batch is committed by itself, so rows are locked only while their batch is updated
+            connection = op.get_bind()
+            after_id = 0
+            while True:
+                updated_ids = connection.execute(
+                    backfill, {'after_id': after_id, 'batch_size': BACKFILL_BATCH_SIZE}
+                ).scalars().all()
+                if not updated_ids:
+                    break
+                after_id = max(updated_ids)
+
+        op.create_index(
+            'ix_Product_search_vector', 'Product', ['search_vector'],
+            unique=False, postgresql_using='gin', postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_Product_search_vector', table_name='Product', postgresql_concurrently=True)
+    op.execute('DROP TRIGGER product_search_vector_update ON "Product"')
+    op.execute('DROP FUNCTION product_search_vector_update()')
+    op.drop_column('Product', 'search_vector')
@@ -0,0 +1,26 @@
+"""user chat id
+
+Revision ID: e52b7a1c9f36
+Revises: c71f0b5e9d24
+Create Date: 2026-10-18 23:05:42.631870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e52b7a1c9f36'
+down_revision = 'c71f0b5e9d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # a nullable column without a default is added without rewriting the table,
+    # chats of existing users are filled on their next /start
+    op.add_column('User', sa.Column('chat_id', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('User', 'chat_id')
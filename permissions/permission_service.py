@@ -0,0 +1,81 @@
+import json
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import NamedTuple, Optional
+
+from aioredis import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database.dals import UserDAL
+from database.unit_of_work import UnitOfWork
+
+
+class UserRoles(NamedTuple):
+    user_id: int
+    is_admin: bool
+
+
+class PermissionService:
+    """
+    Role lookups for permission checks, cached in the process and in Redis
+    """
+    CACHE_KEY = 'permissions:{username}'
+
+    def __init__(self, redis: Redis, ttl: int = config.PERMISSION_CACHE_TTL,
+                 local_ttl: int = config.PERMISSION_LOCAL_CACHE_TTL,
+                 local_size: int = config.PERMISSION_LOCAL_CACHE_SIZE) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local_size = local_size
+        self._local_cache = OrderedDict()
+
+    def _get_local(self, username: str) -> Optional[UserRoles]:
+        cached = self._local_cache.get(username)
+        if cached is None:
+            return None
+        expires_at, roles = cached
+        if expires_at < time.monotonic():
+            del self._local_cache[username]
+            return None
+        return roles
+
+    def _set_local(self, username: str, roles: UserRoles) -> None:
+        self._local_cache[username] = (time.monotonic() + self.local_ttl, roles)
+        self._local_cache.move_to_end(username)
+        if len(self._local_cache) > self.local_size:
+            self._local_cache.popitem(last=False)
+
+    async def get_roles(self, username: str, session: AsyncSession) -> Optional[UserRoles]:
+        roles = self._get_local(username)
+        if roles is not None:
+            return roles
+
+        cache_key = self.CACHE_KEY.format(username=username)
+        cached_roles = await self.redis.get(cache_key)
+        if cached_roles is not None:
+            roles = UserRoles(**json.loads(cached_roles))
+        else:
+            user_dal = UserDAL(session=session)
+            user_roles = await user_dal.get_user_roles(username)
+            if user_roles is None:
+                return None
+            roles = UserRoles(*user_roles)
+            await self.redis.set(cache_key, json.dumps(roles._asdict()), ex=self.ttl)
+
+        self._set_local(username, roles)
+        return roles
+
+    async def invalidate(self, username: str) -> None:
+        self._local_cache.pop(username, None)
+        await self.redis.delete(self.CACHE_KEY.format(username=username))
+
+    async def set_admin(self, username: str, is_admin: bool, session: AsyncSession) -> None:
+        """
+        Changes the admin flag, the cached roles are dropped after the change is committed
+        """
+        user_dal = UserDAL(session=session)
+        await user_dal.set_admin(username=username, is_admin=is_admin)
+        UnitOfWork.after_commit(session, partial(self.invalidate, username))
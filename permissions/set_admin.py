@@ -0,0 +1,36 @@
+"""
+Grants or revokes the admin role. Roles are cached, so the flag is changed only here and not in the database
+by hand: the cached roles of the user are dropped after the change is committed, then other processes
+see it not later than in PERMISSION_LOCAL_CACHE_TTL. A flag changed by hand is seen only when
+the cached roles expire, not later than in PERMISSION_CACHE_TTL
+
+    python -m permissions.set_admin username
+    python -m permissions.set_admin username --revoke
+"""
+import argparse
+import asyncio
+import logging
+
+from database.dals import UserDAL
+from database.unit_of_work import UnitOfWork
+from loader import async_sessionmaker, engine, permission_service, redis_cache
+
+
+async def main(args: argparse.Namespace) -> None:
+    try:
+        async with async_sessionmaker() as session:
+            if await UserDAL(session=session).get_user_roles(args.username) is None:
+                logging.error(f'USER {args.username} NOT FOUND')
+                return
+            await permission_service.set_admin(username=args.username, is_admin=not args.revoke, session=session)
+            await UnitOfWork.commit(session)
+    finally:
+        await engine.dispose()
+        await redis_cache.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('username', help='username of the user in Telegram')
+    parser.add_argument('--revoke', action='store_true', help='take the admin role away instead of granting it')
+    asyncio.run(main(parser.parse_args()))
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ProductSerializer(BaseModel):
@@ -6,3 +8,14 @@ class ProductSerializer(BaseModel):
     name: str
     description: str
     image_path: str
+
+
+class ProductImportSerializer(BaseModel):
+    """
+    A row of an imported products file, image is a file of the archive or an image stored before
+    """
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    name: str = Field(min_length=1, max_length=35)
+    description: str = Field(min_length=1)
+    image: Optional[str] = None
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator, Optional
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+import config
+from services.metrics import BOT_API_QUEUE_DEPTH, BOT_API_QUEUE_WAIT, BOT_API_RETRIES
+
+
+class Lane(IntEnum):
+    """
+    Priority of outbound requests, a lower value is sent first
+    """
+    INTERACTIVE = 0
+    CLEANUP = 1
+    BULK = 2
+
+
+_current_lane = ContextVar('bot_request_lane', default=Lane.INTERACTIVE)
+
+
+@contextmanager
+def lane(value: Lane) -> Iterator[None]:
+    """
+    Sends the Bot API requests made inside the block, and in the tasks created there, in the given lane
+    """
+    token = _current_lane.set(value)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """
+        :return: float - seconds until a token is available
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _Waiter:
+    def __init__(self, chat_id: Optional[int]) -> None:
+        self.chat_id = chat_id
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class BotScheduler:
+    """
+    Sends the messages of the bot within Telegram limits: every request that sends, edits or deletes
+    messages waits for a token of the global bucket and of the bucket of its chat. Waiting requests
+    are granted by lanes, so replies to users are not queued behind cleanups and broadcasts.
+    Requests answered by RetryAfter block their chat for the given time and are sent again.
+    It replaces Bot.request, so the methods of Bot are called as usual
+    """
+    SCHEDULED_METHODS = ('send', 'edit', 'delete', 'forward', 'copy', 'pin', 'unpin', 'stop')
+
+    def __init__(self, bot: Bot, global_rate: float = config.BOT_GLOBAL_RATE,
+                 chat_rate: float = config.BOT_CHAT_RATE, chat_burst: int = config.BOT_CHAT_BURST,
+                 max_retries: int = config.BOT_MAX_RETRIES, retry_jitter: float = config.BOT_RETRY_JITTER,
+                 chats_size: int = config.BOT_SCHEDULER_CHATS_SIZE) -> None:
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_jitter = retry_jitter
+        self.chats_size = chats_size
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_rate)
+        self._chat_buckets = OrderedDict()
+        self._lanes = {lane_: deque() for lane_ in Lane}
+        self._wakeup = asyncio.Event()
+        self._request = None
+        self._task = None
+
+    def install(self) -> None:
+        self._request = self.bot.request
+        self.bot.request = self.request
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self.chat_rate, capacity=self.chat_burst)
+            if len(self._chat_buckets) > self.chats_size:
+                self._chat_buckets.popitem(last=False)
+        self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _report_depth(self, lane_: Lane) -> None:
+        BOT_API_QUEUE_DEPTH.labels(lane=lane_.name.lower()).set(len(self._lanes[lane_]))
+
+    async def _acquire(self, chat_id: Optional[int], lane_: Lane, retry: bool = False) -> None:
+        waiter = _Waiter(chat_id)
+        if retry:
+            self._lanes[lane_].appendleft(waiter)
+        else:
+            self._lanes[lane_].append(waiter)
+        self._report_depth(lane_)
+        self._wakeup.set()
+        await waiter.future
+        BOT_API_QUEUE_WAIT.labels(lane=lane_.name.lower()).observe(time.monotonic() - waiter.enqueued)
+
+    def _grant(self) -> Optional[float]:
+        """
+        Lets the waiting requests go in the order of lanes while there are tokens,
+        requests of one chat keep their order in a lane
+        :return: float - seconds until the next request can go, None if nothing waits
+        """
+        now = time.monotonic()
+        next_in = None
+        for lane_, waiters in self._lanes.items():
+            waiting, blocked_chats = deque(), set()
+            while waiters:
+                waiter = waiters.popleft()
+                if waiter.future.done():
+                    continue
+                global_delay = self._global_bucket.delay(now)
+                chat_delay = 0
+                if waiter.chat_id in blocked_chats:
+                    chat_delay = None
+                elif waiter.chat_id is not None:
+                    chat_delay = self._get_chat_bucket(waiter.chat_id).delay(now)
+                if global_delay > 0 or chat_delay is None or chat_delay > 0:
+                    waiting.append(waiter)
+                    blocked_chats.add(waiter.chat_id)
+                    delay = global_delay or chat_delay
+                    if delay:
+                        next_in = delay if next_in is None else min(next_in, delay)
+                    continue
+                self._global_bucket.take()
+                if waiter.chat_id is not None:
+                    self._chat_buckets[waiter.chat_id].take()
+                waiter.future.set_result(None)
+            self._lanes[lane_] = waiting
+            self._report_depth(lane_)
+        return next_in
+
+    async def run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            next_in = self._grant()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_in)
+            except asyncio.TimeoutError:
+                pass
+
+    @classmethod
+    def _is_scheduled(cls, method: str) -> bool:
+        return method.startswith(cls.SCHEDULED_METHODS)
+
+    @staticmethod
+    def _rewind(files: Optional[dict]) -> None:
+        # uploaded files are read to the end by the failed attempt
+        for file in (files or {}).values():
+            file = getattr(file, 'file', file)
+            if hasattr(file, 'seek'):
+                file.seek(0)
+
+    async def request(self, method: str, data: Optional[dict] = None, files: Optional[dict] = None, **kwargs):
+        if self._task is None or not self._is_scheduled(method):
+            return await self._request(method, data, files, **kwargs)
+
+        chat_id = (data or {}).get('chat_id')
+        lane_ = _current_lane.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane_, retry=attempt > 0)
+            try:
+                return await self._request(method, data, files, **kwargs)
+            except RetryAfter as error:
+                if attempt == self.max_retries:
+                    raise
+                # the jitter keeps the requests blocked together from coming back at the same moment
+                until = time.monotonic() + error.timeout + random.uniform(0, self.retry_jitter)
+                if chat_id is None:
+                    self._global_bucket.block(until)
+                else:
+                    self._get_chat_bucket(chat_id).block(until)
+                BOT_API_RETRIES.labels(method=method).inc()
+                logging.info(f'{method.upper()} TO CHAT {chat_id} IS RETRIED IN {error.timeout} SECONDS')
+                self._rewind(files)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            # the loop is not granting requests any more when the waiters are released
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # the waiting requests are sent without limits, so the shutdown is not held by them
+        for waiters in self._lanes.values():
+            for waiter in waiters:
+                if not waiter.future.done():
+                    waiter.future.set_result(None)
+            waiters.clear()
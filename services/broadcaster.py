@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import time
+from functools import partial
+
+from aiogram import Bot
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, RetryAfter, TelegramAPIError, UserDeactivated
+from aioredis import Redis
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import config
+from database.dals import UserDAL
+from keyboards.inline_keyboard import InlineKeyboard
+from services.bot_scheduler import Lane, lane
+from services.media_registry import MediaRegistry
+from services.metrics import BROADCAST_MESSAGES
+
+
+class Broadcaster:
+    """
+    Announces a product to all the users with known chats. Users are read by keyset windows, a window is
+    loaded by one short query, so neither the table is loaded nor a transaction stays open while messages
+    are sent. Messages go in batches not faster than config.BROADCAST_RATE, in the bulk lane of the bot
+    scheduler, so replies to users go first. The last user of every sent batch is kept in Redis: a failed
+    broadcast is resumed from it after a delay, and broadcasts that were running are resumed on the next start
+    """
+    STATE_KEY = 'broadcast:{product_id}'
+    LOCK_KEY = 'broadcast:{product_id}:lock'
+    ACTIVE_KEY = 'broadcasts:active'
+    # the lock is renewed by every batch, so a stopped process releases its broadcasts in this time
+    LOCK_TTL = 5 * 60
+    BLOCKED_ERRORS = (BotBlocked, ChatNotFound, UserDeactivated)
+
+    def __init__(self, bot: Bot, redis: Redis, session_pool: async_sessionmaker, media_registry: MediaRegistry,
+                 rate: float = config.BROADCAST_RATE, batch_size: int = config.BROADCAST_BATCH_SIZE,
+                 window: int = config.BROADCAST_WINDOW,
+                 progress_interval: float = config.BROADCAST_PROGRESS_INTERVAL,
+                 retry_delay: float = config.BROADCAST_RETRY_DELAY,
+                 max_retries: int = config.BROADCAST_MAX_RETRIES) -> None:
+        self.bot = bot
+        self.redis = redis
+        self.session_pool = session_pool
+        self.media_registry = media_registry
+        self.rate = rate
+        self.batch_size = batch_size
+        self.window = window
+        self.progress_interval = progress_interval
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self._tasks = {}
+
+    async def start(self, product: dict, chat_id: int) -> bool:
+        """
+        :param product: dict - serialized product
+        :param chat_id: int - chat of the admin, the progress is reported there
+        :return: bool - False if the product is being broadcast already
+        """
+        product_id = product['product_id']
+        if not await self.redis.set(self.LOCK_KEY.format(product_id=product_id), 1, nx=True, ex=self.LOCK_TTL):
+            return False
+        state = {
+            'product': json.dumps(product, default=str),
+            'chat_id': chat_id,
+            'after_id': 0,
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'started': time.time()
+        }
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self.STATE_KEY.format(product_id=product_id))
+            pipe.hset(self.STATE_KEY.format(product_id=product_id), mapping=state)
+            pipe.sadd(self.ACTIVE_KEY, product_id)
+            await pipe.execute()
+        self._run_task(product_id)
+        return True
+
+    async def resume(self) -> None:
+        for product_id in await self.redis.smembers(self.ACTIVE_KEY):
+            if await self.redis.set(self.LOCK_KEY.format(product_id=product_id), 1, nx=True, ex=self.LOCK_TTL):
+                logging.info(f'BROADCAST OF PRODUCT {product_id} IS RESUMED')
+                self._run_task(int(product_id))
+
+    async def stop(self) -> None:
+        # the checkpoints stay, so the broadcasts are resumed by the next start
+        tasks = dict(self._tasks)
+        for task in tasks.values():
+            task.cancel()
+        # the locks are released only when the tasks are done with their checkpoints
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        for product_id in tasks:
+            await self.redis.delete(self.LOCK_KEY.format(product_id=product_id))
+        self._tasks.clear()
+
+    def _run_task(self, product_id: int) -> None:
+        task = asyncio.create_task(self._run_with_retries(product_id))
+        self._tasks[product_id] = task
+        task.add_done_callback(partial(self._on_done, product_id))
+
+    def _on_done(self, product_id: int, task: asyncio.Task) -> None:
+        self._tasks.pop(product_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            # the broadcast stays active and is resumed from its checkpoint by the next start
+            logging.error(f'BROADCAST OF PRODUCT {product_id} FAILED: {task.exception()!r}')
+
+    async def _run_with_retries(self, product_id: int) -> None:
+        lock_key = self.LOCK_KEY.format(product_id=product_id)
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._run(product_id)
+                return
+            except Exception as error:
+                if attempt == self.max_retries:
+                    # the lock is released, so the broadcast is resumed by the next start of any process
+                    await self.redis.delete(lock_key)
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logging.error(f'BROADCAST OF PRODUCT {product_id} FAILED: {error!r}, RESUMED IN {delay} SECONDS')
+                # the lock is kept by this process while it waits
+                await self.redis.expire(lock_key, int(self.LOCK_TTL + delay))
+                await asyncio.sleep(delay)
+
+    async def _send(self, chat_id: int, product: dict, reply_markup: str) -> str:
+        caption = f"<b>Новинка: {product['name']}</b>\n{product['description']}"
+        for attempt in range(2):
+            try:
+                await self.media_registry.send_photo(
+                    chat_id=chat_id, image_path=product['image_path'], caption=caption,
+                    parse_mode='HTML', reply_markup=reply_markup
+                )
+                return 'sent'
+            except self.BLOCKED_ERRORS:
+                return 'blocked'
+            except RetryAfter as error:
+                # the bot scheduler retries by itself, this is left for the bot without it
+                if attempt == 1:
+                    return 'failed'
+                await asyncio.sleep(error.timeout)
+            except TelegramAPIError as error:
+                logging.info(f'BROADCAST TO CHAT {chat_id} FAILED: {error}')
+                return 'failed'
+
+    async def _send_batch(self, chat_ids: list[int], product: dict, reply_markup: str) -> dict:
+        results = []
+        # the image is uploaded by the first message and sent by its file_id afterwards
+        if await self.media_registry.get_file_id(product['image_path']) is None:
+            results.append(await self._send(chat_ids[0], product, reply_markup))
+            chat_ids = chat_ids[1:]
+        results += await asyncio.gather(*(self._send(chat_id, product, reply_markup) for chat_id in chat_ids))
+        counts = {'sent': 0, 'failed': 0, 'blocked': 0}
+        for result in results:
+            counts[result] += 1
+            BROADCAST_MESSAGES.labels(result=result).inc()
+        return counts
+
+    async def _checkpoint(self, product_id: int, after_id: int, counts: dict) -> None:
+        state_key = self.STATE_KEY.format(product_id=product_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(state_key, 'after_id', after_id)
+            for name, count in counts.items():
+                pipe.hincrby(state_key, name, count)
+            pipe.expire(self.LOCK_KEY.format(product_id=product_id), self.LOCK_TTL)
+            await pipe.execute()
+
+    async def _report(self, state: dict, finished: bool = False) -> None:
+        elapsed = max(time.time() - float(state['started']), 1)
+        text = (
+            f"{'Рассылка завершена' if finished else 'Идёт рассылка'}: "
+            f"отправлено {state['sent']}, заблокировали бота {state['blocked']}, ошибок {state['failed']}, "
+            f"{int(state['sent']) / elapsed:.1f} сообщений в секунду"
+        )
+        try:
+            await self.bot.send_message(chat_id=state['chat_id'], text=text)
+        except TelegramAPIError as error:
+            logging.info(f'BROADCAST REPORT IS NOT SENT: {error}')
+
+    async def _run(self, product_id: int) -> None:
+        state_key = self.STATE_KEY.format(product_id=product_id)
+        state = await self.redis.hgetall(state_key)
+        product = json.loads(state['product'])
+        after_id = int(state['after_id'])
+        reply_markup = (await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
+            product_id=product_id, delete_or_add='add'
+        )).as_json()
+        reported = time.monotonic()
+
+        with lane(Lane.BULK):
+            while True:
+                async with self.session_pool() as session:
+                    users = await UserDAL(session=session).get_chat_ids(after_id=after_id, limit=self.window)
+                for first in range(0, len(users), self.batch_size):
+                    batch = users[first:first + self.batch_size]
+                    started = time.monotonic()
+                    counts = await self._send_batch([row.chat_id for row in batch], product, reply_markup)
+                    after_id = batch[-1].user_id
+                    await self._checkpoint(product_id, after_id, counts)
+
+                    if time.monotonic() - reported >= self.progress_interval:
+                        await self._report(await self.redis.hgetall(state_key))
+                        reported = time.monotonic()
+                    # keeps the rate of the broadcast below the global limit of the bot
+                    delay = len(batch) / self.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if len(users) < self.window:
+                    break
+
+        state = await self.redis.hgetall(state_key)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.srem(self.ACTIVE_KEY, product_id)
+            pipe.delete(self.LOCK_KEY.format(product_id=product_id))
+            await pipe.execute()
+        logging.info(
+            f'BROADCAST OF PRODUCT {product_id} IS FINISHED: '
+            f"SENT {state['sent']}, BLOCKED {state['blocked']}, FAILED {state['failed']}"
+        )
+        await self._report(state, finished=True)
+
@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Union
+
+from aiogram import Bot, types
+from aiogram.types import InputFile, InputMediaPhoto
+from aiogram.utils.exceptions import WrongFileIdentifier, WrongRemoteFileIdSpecified
+from aioredis import Redis
+
+import config
+from services.media_store import get_digest
+
+Photo = Union[str, InputFile]
+
+
+class MediaRegistry:
+    """
+    Remembers the Telegram file_id of every uploaded image by its content hash,
+    so an image is uploaded from disk only once and is sent by file_id afterwards
+    """
+    CACHE_KEY = 'media:file_ids'
+
+    def __init__(self, redis: Redis, bot: Bot, digest_cache_size: int = config.MEDIA_DIGEST_CACHE_SIZE) -> None:
+        self.redis = redis
+        self.bot = bot
+        self.digest_cache_size = digest_cache_size
+        # digests of images that are not stored by MediaStore, by path, the least recently used are dropped
+        self._digests = OrderedDict()
+
+    @staticmethod
+    def _hash_file(image_path: str, cached: Optional[tuple]) -> Optional[tuple]:
+        # runs in a thread, the file is read again only when it has changed
+        try:
+            stat = os.stat(image_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if cached is not None and cached[0] == signature:
+                return cached
+            with open(image_path, 'rb') as file:
+                return signature, hashlib.sha256(file.read()).hexdigest()
+        except FileNotFoundError:
+            return None
+
+    async def _get_digest(self, image_path: str) -> Optional[str]:
+        """
+        :param image_path: str
+        :return: digest of the image content, None if there is no such file
+        """
+        # images of MediaStore carry the digest in the path, so no file is read
+        digest = get_digest(image_path)
+        if digest is not None:
+            return digest
+
+        hashed = await asyncio.to_thread(self._hash_file, image_path, self._digests.get(image_path))
+        if hashed is None:
+            logging.warning(f'IMAGE {image_path} NOT FOUND')
+            self._digests.pop(image_path, None)
+            return None
+        self._digests[image_path] = hashed
+        self._digests.move_to_end(image_path)
+        if len(self._digests) > self.digest_cache_size:
+            self._digests.popitem(last=False)
+        return hashed[1]
+
+    async def get_file_id(self, image_path: str) -> Optional[str]:
+        digest = await self._get_digest(image_path)
+        if digest is None:
+            return None
+        return await self.redis.hget(self.CACHE_KEY, digest)
+
+    async def get_file_ids(self, image_paths: list[str]) -> list[Optional[str]]:
+        """
+        :param image_paths: list[str]
+        :return: list - cached file_id or None of every image, by one HMGET, None for missing images too
+        """
+        digests = await asyncio.gather(*(self._get_digest(image_path) for image_path in image_paths))
+        found = [digest for digest in digests if digest is not None]
+        if not found:
+            return [None] * len(image_paths)
+        file_ids = dict(zip(found, await self.redis.hmget(self.CACHE_KEY, found)))
+        return [file_ids.get(digest) for digest in digests]
+
+    async def register(self, image_path: str, file_id: str) -> None:
+        digest = await self._get_digest(image_path)
+        if digest is not None:
+            await self.redis.hset(self.CACHE_KEY, digest, file_id)
+
+    async def forget(self, image_path: str) -> None:
+        digest = await self._get_digest(image_path)
+        if digest is not None:
+            await self.redis.hdel(self.CACHE_KEY, digest)
+
+    @staticmethod
+    def _read_file(image_path: str) -> bytes:
+        with open(image_path, 'rb') as file:
+            return file.read()
+
+    async def get_photo(self, image_path: str) -> Photo:
+        """
+        :param image_path: str
+        :return: cached file_id or InputFile with the image content
+        """
+        file_id = await self.get_file_id(image_path)
+        if file_id is not None:
+            return file_id
+
+        content = await asyncio.to_thread(self._read_file, image_path)
+        return InputFile(io.BytesIO(content), filename=os.path.basename(image_path))
+
+    async def _send(self, image_path: str, send: Callable[[Photo], Awaitable]) -> Union[types.Message, bool]:
+        photo = await self.get_photo(image_path)
+        try:
+            message = await send(photo)
+        except (WrongFileIdentifier, WrongRemoteFileIdSpecified):
+            if not isinstance(photo, str):
+                raise
+            logging.info(f'FILE_ID OF {image_path} IS INVALID, UPLOADING AGAIN')
+            await self.forget(image_path)
+            photo = await self.get_photo(image_path)
+            message = await send(photo)
+
+        if not isinstance(photo, str) and isinstance(message, types.Message) and message.photo:
+            await self.register(image_path, message.photo[-1].file_id)
+        return message
+
+    async def answer_photo(self, message: types.Message, image_path: str, **kwargs) -> types.Message:
+        return await self._send(image_path, lambda photo: message.answer_photo(photo, **kwargs))
+
+    async def send_photo(self, chat_id: int, image_path: str, **kwargs) -> types.Message:
+        return await self._send(image_path, lambda photo: self.bot.send_photo(chat_id, photo, **kwargs))
+
+    async def edit_message_media(self, chat_id: int, message_id: int, image_path: str, caption: str = None,
+                                 parse_mode: str = None, reply_markup=None) -> Union[types.Message, bool]:
+        return await self._send(image_path, lambda photo: self.bot.edit_message_media(
+            media=InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode),
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup
+        ))
+
+    async def send_media_group(self, chat_id: int, forms: list[dict]) -> list[types.Message]:
+        """
+        Sends the images as one album
+        :param chat_id: int
+        :param forms: list of dicts with image_path, caption and parse_mode, from 2 to 10 items
+        :return: list[Message] - messages of the album in the order of forms
+        """
+        def form_media(photos: list[Photo]) -> list[InputMediaPhoto]:
+            return [
+                InputMediaPhoto(photo, caption=form.get('caption'), parse_mode=form.get('parse_mode'))
+                for photo, form in zip(photos, forms)
+            ]
+
+        photos = [await self.get_photo(form['image_path']) for form in forms]
+        try:
+            messages = await self.bot.send_media_group(chat_id, form_media(photos))
+        except (WrongFileIdentifier, WrongRemoteFileIdSpecified):
+            if not any(isinstance(photo, str) for photo in photos):
+                raise
+            # Telegram does not tell which file_id of the album is invalid
+            logging.info(f'FILE_ID IN ALBUM OF {len(forms)} IMAGES IS INVALID, UPLOADING AGAIN')
+            for photo, form in zip(photos, forms):
+                if isinstance(photo, str):
+                    await self.forget(form['image_path'])
+            photos = [await self.get_photo(form['image_path']) for form in forms]
+            messages = await self.bot.send_media_group(chat_id, form_media(photos))
+
+        for photo, form, message in zip(photos, forms, messages):
+            if not isinstance(photo, str) and message.photo:
+                await self.register(form['image_path'], message.photo[-1].file_id)
+        return messages
@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+from PIL import Image
+
+import config
+
+CATALOG_SUFFIX = '.jpg'
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+class StoredImage(NamedTuple):
+    digest: str
+    image_path: str
+
+
+def get_digest(image_path: str) -> Optional[str]:
+    """
+    :param image_path: str
+    :return: digest of the content the image is stored by, None if the image is not stored by MediaStore
+    """
+    directory, file_name = os.path.split(image_path)
+    digest = file_name[:-len(CATALOG_SUFFIX)]
+    if (file_name.endswith(CATALOG_SUFFIX) and DIGEST_PATTERN.fullmatch(digest)
+            and os.path.basename(directory) == digest[:2]):
+        return digest
+    return None
+
+
+def _save_resized(image: Image.Image, size: int, path: str) -> None:
+    resized = image.copy()
+    resized.thumbnail((size, size))
+    # written under a temporary name, so readers never see a half written file
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    resized.save(temporary_path, format='JPEG', quality=config.MEDIA_JPEG_QUALITY, optimize=True)
+    os.replace(temporary_path, path)
+
+
+def process_image(content: bytes, root: str, catalog_size: int) -> StoredImage:
+    """
+    Runs in a worker process: stores the image by the hash of its content
+    as a catalog-size image, an already stored image is not processed again.
+    Telegram makes its own thumbnails of sent photos, so no thumbnails are stored
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    directory = os.path.join(root, digest[:2])
+    stored_image = StoredImage(
+        digest=digest,
+        image_path=os.path.join(directory, digest + CATALOG_SUFFIX)
+    )
+    if os.path.exists(stored_image.image_path):
+        return stored_image
+
+    os.makedirs(directory, exist_ok=True)
+    with Image.open(io.BytesIO(content)) as image:
+        image = image.convert('RGB')
+        _save_resized(image, catalog_size, stored_image.image_path)
+    return stored_image
+
+
+class MediaStore:
+    """
+    Content-addressed store of product images, images are processed in a process pool,
+    so the event loop is never blocked by decoding and resizing
+    """
+
+    def __init__(self, root: str = config.MEDIA_ROOT, catalog_size: int = config.CATALOG_IMAGE_SIZE,
+                 processes: int = config.MEDIA_PROCESSES) -> None:
+        self.root = root
+        self.catalog_size = catalog_size
+        self.processes = processes
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def save(self, content: bytes) -> StoredImage:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processes)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, process_image, content, self.root, self.catalog_size
+        )
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
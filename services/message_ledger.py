@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+from aiogram import Bot
+from aiogram.utils.exceptions import TelegramAPIError, MethodNotKnown
+from aioredis import Redis
+
+import config
+from services.bot_scheduler import Lane, lane
+
+
+class MessageLedger:
+    """
+    Ids of the messages that are deleted on the next command of the user,
+    kept in a Redis list, so adding an id is one atomic RPUSH
+    """
+    KEY = '{username}:useless_messages_ledger'
+    # the messages of the shown pages are deleted together with the ledger
+    PAGES_KEYS = (':product', ':basket', ':search')
+    # Telegram does not allow bots to delete messages older than 48 hours
+    TTL = 48 * 60 * 60
+
+    # takes the ledger and the pages data at once, ARGV are TTL and the ids that start the new ledger
+    DRAIN_SCRIPT = """
+    local messages = redis.call('LRANGE', KEYS[1], 0, -1)
+    local pages = {}
+    for i = 2, #KEYS do
+        pages[i - 1] = redis.call('GET', KEYS[i]) or ''
+    end
+    redis.call('DEL', unpack(KEYS))
+    if #ARGV > 1 then
+        redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+    end
+    return {messages, pages}
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+        self._drain = redis.register_script(self.DRAIN_SCRIPT)
+
+    async def add(self, username: str, *message_ids: int) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(self.KEY.format(username=username), *message_ids)
+            pipe.expire(self.KEY.format(username=username), self.TTL)
+            await pipe.execute()
+
+    async def drain(self, username: str, *new_message_ids: int) -> list[int]:
+        """
+        Atomically takes all the useless messages of the user
+        :param username: str
+        :param new_message_ids: ids the new ledger starts with
+        :return: list[int]
+        """
+        keys = [self.KEY.format(username=username), *(username + key for key in self.PAGES_KEYS)]
+        messages, pages = await self._drain(keys=keys, args=[self.TTL, *new_message_ids])
+
+        message_ids = [int(message) for message in messages]
+        for page_data in pages:
+            if page_data:
+                page_data = json.loads(page_data)
+                message_ids.extend(page_data['messages'])
+                message_ids.append(page_data['tab_message'])
+        return [message for message in message_ids if message is not None]
+
+
+class MessageCleaner:
+    """
+    Deletes messages in background, so handlers do not wait for the cleanup.
+    Messages of one chat are deleted by one deleteMessages request when the Bot API supports it
+    """
+    BULK_LIMIT = 100
+
+    def __init__(self, bot: Bot, batch_delay: float = config.MESSAGE_CLEANER_DELAY) -> None:
+        self.bot = bot
+        self.batch_delay = batch_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+        # messages taken from the queue and not deleted yet
+        self._batch = defaultdict(list)
+        self._bulk_supported = True
+
+    def schedule(self, chat_id: int, message_ids: list[int]) -> None:
+        if message_ids:
+            self._queue.put_nowait((chat_id, message_ids))
+
+    async def _delete_one_by_one(self, chat_id: int, message_ids: list[int]) -> None:
+        for message_id in message_ids:
+            try:
+                await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except TelegramAPIError as error:
+                logging.info(f'MESSAGE {message_id} IN CHAT {chat_id} IS NOT DELETED: {error}')
+
+    async def delete(self, chat_id: int, message_ids: list[int]) -> None:
+        for i in range(0, len(message_ids), self.BULK_LIMIT):
+            chunk = message_ids[i:i + self.BULK_LIMIT]
+            if self._bulk_supported:
+                try:
+                    await self.bot.request('deleteMessages', {'chat_id': chat_id, 'message_ids': json.dumps(chunk)})
+                    continue
+                except MethodNotKnown:
+                    self._bulk_supported = False
+                except TelegramAPIError as error:
+                    logging.info(f'BULK DELETE IN CHAT {chat_id} FAILED: {error}')
+            await self._delete_one_by_one(chat_id, chunk)
+
+    async def _collect_batch(self) -> None:
+        chat_id, message_ids = await self._queue.get()
+        self._batch[chat_id].extend(message_ids)
+        # gives other updates a moment to add their messages into the same batch
+        await asyncio.sleep(self.batch_delay)
+        while not self._queue.empty():
+            chat_id, message_ids = self._queue.get_nowait()
+            self._batch[chat_id].extend(message_ids)
+
+    async def _delete_batch(self, batch: dict[int, list[int]]) -> None:
+        results = await asyncio.gather(*(
+            self.delete(chat_id, list(dict.fromkeys(message_ids))) for chat_id, message_ids in batch.items()
+        ), return_exceptions=True)
+        for error in results:
+            if error is not None:
+                logging.warning(f'MESSAGES CLEANUP FAILED: {error!r}')
+
+    async def run(self) -> None:
+        # deletions wait for replies to users, when the bot is at its rate limits
+        with lane(Lane.CLEANUP):
+            while True:
+                await self._collect_batch()
+                batch, self._batch = self._batch, defaultdict(list)
+                deleting = asyncio.ensure_future(self._delete_batch(batch))
+                try:
+                    await asyncio.shield(deleting)
+                except asyncio.CancelledError:
+                    # the batch being deleted is finished on stop, so its messages are not deleted twice
+                    await deleting
+                    raise
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # messages of a batch that was still being collected are deleted with the rest of the queue
+        while not self._queue.empty():
+            chat_id, message_ids = self._queue.get_nowait()
+            self._batch[chat_id].extend(message_ids)
+        batch, self._batch = self._batch, defaultdict(list)
+        await self._delete_batch(batch)
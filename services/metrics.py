@@ -0,0 +1,144 @@
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+from aiohttp import web
+from aioredis import Redis
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import config
+
+HANDLER_DURATION = Histogram('bot_handler_duration_seconds', 'Time of handling an update', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Updates whose handler raised', ['handler'])
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Time of a SQL statement', ['statement'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, float('inf'))
+)
+DB_QUERY_ERRORS = Counter('db_query_errors_total', 'Failed SQL statements', ['statement'])
+REDIS_COMMAND_DURATION = Histogram(
+    'redis_command_duration_seconds', 'Time of a Redis command or pipeline', ['command'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, float('inf'))
+)
+BOT_API_DURATION = Histogram('bot_api_request_duration_seconds', 'Time of a Bot API request', ['method'])
+BOT_API_ERRORS = Counter('bot_api_errors_total', 'Failed Bot API requests', ['method', 'error'])
+BOT_API_RETRY_AFTER = Counter('bot_api_retry_after_total', 'Bot API requests answered by RetryAfter', ['method'])
+BOT_API_RETRIES = Counter('bot_api_retries_total', 'Bot API requests sent again after RetryAfter', ['method'])
+BOT_API_QUEUE_DEPTH = Gauge('bot_api_queue_depth', 'Bot API requests waiting for rate limits', ['lane'])
+BOT_API_QUEUE_WAIT = Histogram(
+    'bot_api_queue_wait_seconds', 'Time a Bot API request waited for rate limits', ['lane'],
+    buckets=(.001, .01, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, float('inf'))
+)
+BROADCAST_MESSAGES = Counter('broadcast_messages_total', 'Messages of product broadcasts', ['result'])
+CALLBACKS_THROTTLED = Counter('bot_callbacks_throttled_total', 'Callbacks dropped by the rate limit', ['handler'])
+CALLBACKS_COALESCED = Counter(
+    'bot_callbacks_coalesced_total', 'Callbacks dropped for a newer click of the same user', ['handler']
+)
+RENDER_CACHE_REQUESTS = Counter('render_cache_requests_total', 'Renders of products by the render cache', ['result'])
+
+
+def _statement_name(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Times every statement sent by the engine
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        started = conn.info['query_started'].pop()
+        DB_QUERY_DURATION.labels(statement=_statement_name(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def handle_error(context) -> None:
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+        DB_QUERY_ERRORS.labels(statement=_statement_name(context.statement or '')).inc()
+
+
+def instrument_redis(redis: Redis) -> None:
+    """
+    Times commands of the client, scripts are timed as EVALSHA and pipelines as PIPELINE
+    """
+    execute_command = redis.execute_command
+    pipeline = redis.pipeline
+
+    async def timed_execute_command(*args, **options):
+        with REDIS_COMMAND_DURATION.labels(command=str(args[0]).upper()).time():
+            return await execute_command(*args, **options)
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*execute_args, **execute_kwargs):
+            with REDIS_COMMAND_DURATION.labels(command='PIPELINE').time():
+                return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    redis.execute_command = timed_execute_command
+    redis.pipeline = timed_pipeline
+
+
+def instrument_bot(bot: Bot) -> None:
+    """
+    Times every Bot API request, all the methods of Bot go through Bot.request
+    """
+    request = bot.request
+
+    async def timed_request(method: str, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        except RetryAfter:
+            BOT_API_RETRY_AFTER.labels(method=method).inc()
+            raise
+        except TelegramAPIError as error:
+            BOT_API_ERRORS.labels(method=method, error=type(error).__name__).inc()
+            raise
+        finally:
+            BOT_API_DURATION.labels(method=method).observe(time.perf_counter() - started)
+
+    bot.request = timed_request
+
+
+async def metrics(request: web.Request) -> web.Response:
+    response = web.Response(body=generate_latest())
+    response.content_type = CONTENT_TYPE_LATEST.split(';')[0]
+    return response
+
+
+class MetricsServer:
+    """
+    Serves the metrics in Prometheus text format on a local port, apart from the webhook app,
+    so they are not exposed together with the webhook
+    """
+
+    def __init__(self, host: str = config.METRICS_HOST, port: int = config.METRICS_PORT,
+                 path: str = config.METRICS_PATH) -> None:
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get(self.path, metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
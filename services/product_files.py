@@ -0,0 +1,148 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Sequence
+
+import config
+from services.media_store import MediaStore
+
+# columns of the product in the database and in the exported file, image is the name read by the import
+PRODUCT_COLUMNS = ('product_id', 'name', 'description', 'image_path', 'created_date')
+EXPORT_COLUMNS = ('product_id', 'name', 'description', 'image', 'created_date')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# the image of products created without one
+DEFAULT_IMAGE_PATH = 'media/Box.png'
+
+
+def get_file_format(file_name: str) -> Optional[str]:
+    """
+    :return: str - csv or json, None for other files
+    """
+    extension = os.path.splitext(file_name.lower())[1]
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.json', '.jsonl', '.ndjson'):
+        return 'json'
+    return None
+
+
+def iter_csv(file: BinaryIO) -> Iterator[dict]:
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    yield from csv.DictReader(text)
+
+
+def iter_json(file: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator:
+    """
+    Reads the items of a JSON array or of JSON lines one by one, without loading the whole file
+    """
+    decoder = json.JSONDecoder()
+    text = io.TextIOWrapper(file, encoding='utf-8-sig')
+    buffer = ''
+    while True:
+        chunk = text.read(chunk_size)
+        buffer += chunk
+        position = 0
+        while True:
+            # brackets of the array and separators between the items are skipped
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the item is cut by the end of the chunk
+                if not chunk:
+                    raise
+                break
+            yield item
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+def iter_products(file: BinaryIO, file_format: str) -> Iterator:
+    return iter_csv(file) if file_format == 'csv' else iter_json(file)
+
+
+class ProductFileWriter:
+    """
+    Writes products into a CSV file or a JSON array by batches
+    """
+
+    def __init__(self, file: BinaryIO, file_format: str) -> None:
+        self.file_format = file_format
+        self._text = io.TextIOWrapper(file, encoding='utf-8', newline='', write_through=False)
+        self._written = 0
+        if file_format == 'csv':
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(EXPORT_COLUMNS)
+        else:
+            self._text.write('[')
+
+    def write(self, products: Sequence[dict]) -> None:
+        for product in products:
+            values = [product[column] for column in PRODUCT_COLUMNS]
+            if self.file_format == 'csv':
+                self._csv.writerow(values)
+            else:
+                self._text.write(',\n' if self._written else '\n')
+                self._text.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False, default=str))
+            self._written += 1
+
+    def close(self) -> None:
+        if self.file_format == 'json':
+            self._text.write('\n]\n')
+        self._text.flush()
+        # the file stays open for the caller
+        self._text.detach()
+
+
+class ImageResolver:
+    """
+    Turns image names of imported rows into stored images: files of the archive are put into the media store
+    once per name, other names are accepted only as images that are stored already
+    """
+
+    def __init__(self, media_store: MediaStore, archive: Optional[zipfile.ZipFile] = None) -> None:
+        self.media_store = media_store
+        self.archive = archive
+        self._members = {}
+        if archive is not None:
+            for member in archive.infolist():
+                if not member.is_dir() and member.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    self._members.setdefault(os.path.basename(member.filename), member)
+        self._paths = {}
+
+    @staticmethod
+    def _is_stored(image_path: str) -> bool:
+        root = os.path.abspath(config.MEDIA_ROOT)
+        path = os.path.abspath(image_path)
+        if image_path == DEFAULT_IMAGE_PATH or os.path.commonpath([root, path]) == root:
+            return os.path.isfile(path)
+        return False
+
+    async def _store(self, name: str) -> Optional[str]:
+        member = self._members.get(os.path.basename(name))
+        if member is not None:
+            try:
+                stored_image = await self.media_store.save(self.archive.read(member))
+            except (OSError, ValueError, zipfile.BadZipFile):
+                # not an image or a broken file, the rows with it are rejected
+                return None
+            return stored_image.image_path
+        return name if self._is_stored(name) else None
+
+    async def resolve(self, names: set[str]) -> dict[str, Optional[str]]:
+        """
+        :param names: set[str] - images of a batch of rows
+        :return: dict - stored path of every image, None for unknown images
+        """
+        new_names = [name for name in names if name not in self._paths]
+        # images of a batch are processed by the process pool of the media store at once
+        paths = await asyncio.gather(*(self._store(name) for name in new_names))
+        self._paths.update(zip(new_names, paths))
+        return {name: self._paths[name] for name in names}
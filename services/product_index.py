@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import logging
+import re
+from collections import Counter, defaultdict
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from database.dals import ProductDAL
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def _words(text: str) -> list[str]:
+    return WORD_PATTERN.findall(text.lower().replace('ё', 'е'))
+
+
+def _trigrams(words: list[str]) -> set[str]:
+    # words are padded like in pg_trgm, so beginnings of words weigh more
+    trigrams = set()
+    for word in words:
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class ProductIndex:
+    """
+    In-process index of product names for inline queries, which come on every keystroke.
+    Words of a query are looked up as prefixes of the name words, queries with typos
+    fall back to trigram similarity. Only new products are loaded after the start,
+    as products are never changed or deleted
+    """
+    COLUMNS = ('product_id', 'name', 'description', 'image_path')
+    LOAD_BATCH_SIZE = 1000
+    MAX_PREFIX_LENGTH = 20
+    # share of the query trigrams found in the name, like word_similarity of pg_trgm
+    SIMILARITY_THRESHOLD = 0.5
+
+    def __init__(self, session_pool: async_sessionmaker) -> None:
+        self.session_pool = session_pool
+        self.version = None
+        self._products = {}
+        self._prefixes = defaultdict(set)
+        self._trigrams = defaultdict(set)
+        # products added by this process on commit do not move the keyset of loads,
+        # so products committed meanwhile by other processes with lower ids are not skipped
+        self._loaded_id = 0
+        self._loading = None
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    async def add(self, product: dict) -> None:
+        product_id = product['product_id']
+        if product_id in self._products:
+            return
+        self._products[product_id] = {column: product[column] for column in self.COLUMNS}
+
+        words = _words(product['name'])
+        for word in words:
+            for length in range(1, min(len(word), self.MAX_PREFIX_LENGTH) + 1):
+                self._prefixes[word[:length]].add(product_id)
+        for trigram in _trigrams(words):
+            self._trigrams[trigram].add(product_id)
+
+    async def load(self, version: int = None) -> None:
+        """
+        Loads products that are not in the index yet by keyset on product_id
+        :param version: int - catalog version the index is up to date with after the load
+        """
+        loaded = 0
+        async with self.session_pool() as session:
+            product_dal = ProductDAL(session=session)
+            while True:
+                products = await product_dal.get_products_page(
+                    limit=self.LOAD_BATCH_SIZE, after_id=self._loaded_id, columns=self.COLUMNS
+                )
+                for product in products:
+                    await self.add(product)
+                    self._loaded_id = product['product_id']
+                loaded += len(products)
+                if len(products) < self.LOAD_BATCH_SIZE:
+                    break
+        if version is not None:
+            self.version = version
+        logging.info(f'LOADED {loaded} PRODUCTS INTO INDEX OF {len(self)} PRODUCTS')
+
+    def sync(self, version: int) -> None:
+        """
+        Loads products created by other processes in background, when the catalog version has changed
+        """
+        if self.version is not None and version <= self.version:
+            return
+        if self._loading is not None and not self._loading.done():
+            return
+        self._loading = asyncio.create_task(self.load(version=version))
+
+    def _match_prefixes(self, words: list[str], count: int) -> list[int]:
+        found = None
+        for word in words:
+            product_ids = self._prefixes.get(word[:self.MAX_PREFIX_LENGTH], set())
+            found = product_ids if found is None else found & product_ids
+            if not found:
+                return []
+        # words longer than indexed prefixes are checked by the name itself
+        long_words = [word for word in words if len(word) > self.MAX_PREFIX_LENGTH]
+        if long_words:
+            matched = []
+            for product_id in found:
+                name = ' '.join(_words(self._products[product_id]['name']))
+                if all(word in name for word in long_words):
+                    matched.append(product_id)
+            found = matched
+        return heapq.nsmallest(count, found, key=lambda product_id: (
+            len(self._products[product_id]['name']), product_id
+        ))
+
+    def _match_trigrams(self, words: list[str], count: int) -> list[int]:
+        trigrams = _trigrams(words)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self._trigrams.get(trigram, ()))
+        matched = (
+            product_id for product_id, shared_count in shared.items()
+            if shared_count / len(trigrams) >= self.SIMILARITY_THRESHOLD
+        )
+        return heapq.nsmallest(count, matched, key=lambda product_id: (
+            -shared[product_id], len(self._products[product_id]['name']), product_id
+        ))
+
+    def search(self, query: str, limit: int, offset: int = 0) -> list[dict]:
+        """
+        :param query: str - text of the inline query
+        :param limit: int
+        :param offset: int
+        :return: list[dict] - the best matches first, the newest products for an empty query
+        """
+        words = _words(query)
+        if not words:
+            product_ids = heapq.nlargest(offset + limit, self._products)
+        else:
+            product_ids = self._match_prefixes(words, offset + limit) or self._match_trigrams(words, offset + limit)
+        return [self._products[product_id] for product_id in product_ids[offset:offset + limit]]
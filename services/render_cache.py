@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import config
+from keyboards.inline_keyboard import InlineKeyboard
+from services.metrics import RENDER_CACHE_REQUESTS
+
+
+class RenderedProduct(NamedTuple):
+    caption: str
+    parse_mode: str
+    # serialized InlineKeyboardMarkup, aiogram sends a string as it is, None for photos of an album
+    reply_markup: Optional[str]
+
+
+class RenderCache:
+    """
+    Ready to send captions and keyboards of products, so a page of known products is not rendered again.
+    Entries are kept by product, catalog version and mode, every change of a product bumps the catalog
+    version, so entries of an older version are dropped at once when a newer version is rendered
+    """
+    # mode of album photos, the buttons of an album are in the tab message under it
+    ALBUM_MODE = 'album'
+
+    def __init__(self, size: int = config.RENDER_CACHE_SIZE) -> None:
+        self.size = size
+        self.version = None
+        self._cache = OrderedDict()
+
+    @staticmethod
+    async def _render(product: dict, delete_or_add: str) -> RenderedProduct:
+        if delete_or_add == RenderCache.ALBUM_MODE:
+            return RenderedProduct(
+                caption=f"<b>{product['name']}</b>\n{product['description']}", parse_mode='HTML', reply_markup=None
+            )
+        caption = f"""
+             <b>{product['name']}</b>
+             {product['description']}
+        """
+        reply_markup = await InlineKeyboard.generate_add_to_basket_or_delete_reply_markup(
+            product_id=product['product_id'], delete_or_add=delete_or_add
+        )
+        return RenderedProduct(caption=caption, parse_mode='HTML', reply_markup=reply_markup.as_json())
+
+    async def render(self, product: dict, delete_or_add: str, version: Optional[int] = None) -> RenderedProduct:
+        """
+        :param product: dict - serialized product
+        :param delete_or_add: str - mode of the product button or ALBUM_MODE
+        :param version: int - catalog version the product is taken from, not cached without it
+        :return: RenderedProduct
+        """
+        if version is None:
+            RENDER_CACHE_REQUESTS.labels(result='skip').inc()
+            return await self._render(product, delete_or_add)
+        if self.version is None or version > self.version:
+            self._cache.clear()
+            self.version = version
+
+        key = (product['product_id'], version, delete_or_add)
+        rendered = self._cache.get(key)
+        if rendered is not None:
+            RENDER_CACHE_REQUESTS.labels(result='hit').inc()
+            self._cache.move_to_end(key)
+            return rendered
+
+        RENDER_CACHE_REQUESTS.labels(result='miss').inc()
+        rendered = await self._render(product, delete_or_add)
+        # pages of an older version are still rendered for users who have them open, but are not cached
+        if version == self.version:
+            self._cache[key] = rendered
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    async def render_album(self, products: list[dict], version: Optional[int] = None) -> list[RenderedProduct]:
+        """
+        :param products: list[dict] - serialized products of the album
+        :param version: int - catalog version the products are taken from
+        :return: list[RenderedProduct] - captions numbered like the buttons of the album keyboard
+        """
+        album = []
+        for number, product in enumerate(products, start=1):
+            rendered = await self.render(product, delete_or_add=self.ALBUM_MODE, version=version)
+            album.append(rendered._replace(caption=f'{number}. {rendered.caption}'))
+        return album
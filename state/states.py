@@ -5,4 +5,8 @@ class ProductState(StatesGroup):
     START_CREATION = State()
     NAME = State()
     DESCRIPTION = State()
-    IMAGE_PATH = State()
\ No newline at end of file
+    IMAGE_PATH = State()
+
+
+class ProductFileState(StatesGroup):
+    FILE = State()
@@ -0,0 +1,126 @@
+"""
+Plan regression test of the hot lookup indexes: a scratch database is migrated to head by Alembic,
+the DAL queries are explained there and have to use the indexes of the a3c9d27e41b8 migration.
+Postgres is the one from the .env, the test is skipped when it is not reachable:
+
+    python -m pytest -q tests
+"""
+import re
+import unittest
+
+import psycopg2
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import config
+from database.dals import BasketDAL, UserDAL
+from database.models import association_basket_table
+
+TEST_DATABASE = f'{config.POSTGRES_DB}_lookup_indexes_test'
+# about the size of a catalog in production, so the planner picks the indexes by the costs of the real tables
+USERS = 100000
+PRODUCTS = 10000
+BASKET_PRODUCTS = 5
+
+
+def database_url(driver: str, database: str) -> str:
+    return (
+        f'postgresql+{driver}://{config.POSTGRES_USER}:{config.POSTGRES_PASSWORD}'
+        f'@{config.POSTGRES_HOST}:{config.POSTGRES_PORT}/{database}'
+    )
+
+
+def execute_autocommit(*statements: str, database: str = config.POSTGRES_DB) -> None:
+    connection = psycopg2.connect(
+        dbname=database, user=config.POSTGRES_USER, password=config.POSTGRES_PASSWORD,
+        host=config.POSTGRES_HOST, port=config.POSTGRES_PORT, connect_timeout=3
+    )
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    finally:
+        connection.close()
+
+
+class ExplainingSession:
+    """
+    Passes queries of a DAL to the session and keeps the plan of every query
+    """
+
+    def __init__(self, session: AsyncSession) -> None:
+        self.session = session
+        self.plans = []
+
+    async def execute(self, query, *args, **kwargs):
+        sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+        plan = await self.session.execute(text(f'EXPLAIN {sql}'))
+        self.plans.append('\n'.join(plan.scalars()))
+        return await self.session.execute(query, *args, **kwargs)
+
+
+class LookupIndexesTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        if not config.POSTGRES_DB:
+            raise unittest.SkipTest('POSTGRES_DB is not set')
+        try:
+            execute_autocommit(f'DROP DATABASE IF EXISTS "{TEST_DATABASE}"')
+        except psycopg2.OperationalError as error:
+            raise unittest.SkipTest(f'Postgres is not reachable: {error}')
+        execute_autocommit(f'CREATE DATABASE "{TEST_DATABASE}"')
+        alembic_config = Config('alembic.ini')
+        alembic_config.set_main_option('sqlalchemy.url', database_url('psycopg2', TEST_DATABASE))
+        command.upgrade(alembic_config, 'head')
+        execute_autocommit(
+            'INSERT INTO "User" (username, is_admin) '
+            f"SELECT 'user_' || i, false FROM generate_series(1, {USERS}) i",
+            'INSERT INTO "Basket" (user_id) SELECT user_id FROM "User"',
+            'INSERT INTO "Product" (name, description, image_path, created_date) '
+            f"SELECT 'product ' || i, 'description', 'media/Box.png', now() FROM generate_series(1, {PRODUCTS}) i",
+            'INSERT INTO association_table (basket_id, product_id) '
+            f'SELECT basket_id, (basket_id * 7 + i * 1999) % {PRODUCTS} + 1 '
+            f'FROM "Basket", generate_series(0, {BASKET_PRODUCTS - 1}) i',
+            'ANALYZE',
+            database=TEST_DATABASE
+        )
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        execute_autocommit(f'DROP DATABASE IF EXISTS "{TEST_DATABASE}"')
+
+    async def asyncSetUp(self) -> None:
+        self.engine = create_async_engine(database_url('asyncpg', TEST_DATABASE))
+        self.session = AsyncSession(self.engine)
+        self.explaining_session = ExplainingSession(self.session)
+
+    async def asyncTearDown(self) -> None:
+        await self.session.close()
+        await self.engine.dispose()
+
+    def assertUsesIndexes(self, *indexes: str) -> None:
+        plan = '\n'.join(self.explaining_session.plans)
+        used = set(re.findall(r'(?:Index Scan using|Index Only Scan using|Bitmap Index Scan on) (\S+)', plan))
+        self.assertTrue(set(indexes) <= used, f'{indexes} are not all used by the plan:\n{plan}')
+
+    async def test_username_lookup(self) -> None:
+        await UserDAL(session=self.explaining_session).get_user_roles(username='user_100')
+        self.assertUsesIndexes('"ix_User_username"')
+
+    async def test_basket_membership_lookup(self) -> None:
+        await BasketDAL(session=self.explaining_session).has_product(username='user_100', product_id=400)
+        self.assertUsesIndexes('"ix_User_username"', '"ix_Basket_user_id"', 'association_table_pkey')
+
+    async def test_basket_page_lookup(self) -> None:
+        await BasketDAL(session=self.explaining_session).get_basket_page(username='user_100', limit=5)
+        self.assertUsesIndexes('"ix_User_username"', '"ix_Basket_user_id"', 'association_table_pkey')
+
+    async def test_product_baskets_lookup(self) -> None:
+        # product deletions look for the baskets of the product
+        query = select(association_basket_table.c.basket_id).where(association_basket_table.c.product_id == 400)
+        await self.explaining_session.execute(query)
+        self.assertUsesIndexes('ix_association_table_product_id')
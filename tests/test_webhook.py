@@ -0,0 +1,68 @@
+"""
+Webhook app tests: Telegram is replaced by a test client POSTing updates to the webhook, the app is
+wired the way executor.set_webhook wires it, with a bare dispatcher, so neither Postgres nor Redis is needed:
+
+    python -m pytest -q tests
+"""
+import unittest
+from unittest import mock
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+from aiohttp.test_utils import TestClient, TestServer
+
+import config
+from webhook import SECRET_TOKEN_HEADER, create_web_app
+
+SECRET = 'test-secret'
+UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'date': 0,
+        'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Test'},
+        'text': 'hello'
+    }
+}
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.secret = mock.patch.object(config, 'WEBHOOK_SECRET', SECRET)
+        self.secret.start()
+        self.dispatched = []
+        self.bot = Bot(token='123456:webhook-test-token')
+        dp = Dispatcher(self.bot)
+
+        async def record(message: types.Message) -> None:
+            self.dispatched.append(message.text)
+
+        dp.register_message_handler(record)
+        app = create_web_app()
+        app.router.add_route('*', config.WEBHOOK_PATH, WebhookRequestHandler)
+        app[BOT_DISPATCHER_KEY] = dp
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+        await (await self.bot.get_session()).close()
+        self.secret.stop()
+
+    async def test_health(self) -> None:
+        response = await self.client.get(config.HEALTH_PATH)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.json(), {'status': 'ok'})
+
+    async def test_update_without_secret_token_is_rejected(self) -> None:
+        response = await self.client.post(config.WEBHOOK_PATH, json=UPDATE)
+        self.assertEqual(response.status, 401)
+        response = await self.client.post(config.WEBHOOK_PATH, json=UPDATE, headers={SECRET_TOKEN_HEADER: 'wrong'})
+        self.assertEqual(response.status, 401)
+        self.assertEqual(self.dispatched, [])
+
+    async def test_update_with_secret_token_is_dispatched(self) -> None:
+        response = await self.client.post(config.WEBHOOK_PATH, json=UPDATE, headers={SECRET_TOKEN_HEADER: SECRET})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.dispatched, ['hello'])
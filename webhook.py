@@ -0,0 +1,30 @@
+import hmac
+
+from aiohttp import web
+
+import config
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+@web.middleware
+async def verify_secret_token(request: web.Request, handler) -> web.StreamResponse:
+    """
+    Telegram sends the secret token given in set_webhook with every update,
+    requests to the webhook path without it are rejected
+    """
+    if config.WEBHOOK_SECRET and request.path == config.WEBHOOK_PATH:
+        secret_token = request.headers.get(SECRET_TOKEN_HEADER, '')
+        if not hmac.compare_digest(secret_token, config.WEBHOOK_SECRET):
+            raise web.HTTPUnauthorized()
+    return await handler(request)
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({'status': 'ok'})
+
+
+def create_web_app() -> web.Application:
+    app = web.Application(middlewares=[verify_secret_token])
+    app.router.add_get(config.HEALTH_PATH, health)
+    return app